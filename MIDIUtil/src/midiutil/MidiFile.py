@@ -11,10 +11,22 @@
 # -----------------------------------------------------------------------------
 
 from __future__ import division, print_function
+from array import array
+import bisect
+from collections import namedtuple
+import heapq
+from itertools import islice
 import math
+import mmap
+import operator
 import struct
 import warnings
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 __version__ = 'HEAD'
 
 # TICKSPERQUARTERNOTE is the number of "ticks" (time measurement in the MIDI file) that
@@ -31,13 +43,30 @@ MINOR = 1
 SHARPS = 1
 FLATS = -1
 
-__all__ = ['MIDIFile', 'MAJOR', 'MINOR', 'SHARPS', 'FLATS']
+__all__ = ['MIDIFile', 'MIDIStreamWriter', 'MIDIFileReader', 'TrackEvent', 'MAJOR', 'MINOR', 'SHARPS', 'FLATS']
+
+# Precompiled encoders for the fixed-size parts of the events, so that each
+# event is packed with one call rather than a byte at a time.
+
+packChannel2 = struct.Struct('>BB').pack       # status, data
+packChannel3 = struct.Struct('>BBB').pack      # status, data1, data2
+packNote = struct.Struct('>BBBB').pack         # delta, status, pitch, velocity
+packMeta = struct.Struct('>BB').pack           # 0xFF, meta event type
+packTempo = struct.Struct('>BBL').pack         # 0xFF, 0x51, length and 24-bit tempo
+packKeySignature = struct.Struct('>BBBBB').pack
+packTimeSignature = struct.Struct('>BBBBBBB').pack
+packUniversalSysEx = struct.Struct('>BBBB').pack  # 0x7E/0x7F, channel, code, subcode
 
 
 class GenericEvent(object):
     '''
     The event class from which specific events are derived
+
+    Events are held in ``__slots__`` rather than an instance ``__dict__``, as a
+    file can hold a great many of them. Derived classes list the attributes
+    they add in their own ``__slots__``.
     '''
+    __slots__ = ('tick', 'insertion_order')
     evtname = None
     sec_sort_order = 0
 
@@ -59,33 +88,66 @@ class GenericEvent(object):
         '''
         return (self.evtname == other.evtname and self.tick == other.tick)
 
+    def identity(self):
+        '''
+        Return a tuple of the attributes which identify the event.
+
+        Two events are duplicates if they have the same identity, which is
+        what duplicate removal keys on. Derived classes which override
+        ``__eq__()`` override this to match. Events are compared with
+        ``__eq__()`` instead if their identity is ``None``, as it is for
+        those which are never duplicates (``__eq__()`` always returns
+        ``False``), or if their class overrides ``__eq__()`` but not this (see
+        :func:`usesIdentity`).
+        '''
+        return (self.evtname, self.tick)
+
     def __hash__(self):
         '''
         Return a hash code for the object.
 
         This is needed in order to allow GenericObject classes to be used
-        as the key in a dict or set. duplicate objects are removed from
-        the event list by storing all the objects in a set, and then
-        reconstructing the list from the set.  The only real requirement
-        for the algorithm is that the hash of equal objects must be equal.
-        There is probably great opportunity for improvements in the hashing
-        function.
-        '''
-        # Robert Jenkin's 32 bit hash.
-        a = int(self.tick)
-        a = (a + 0x7ed55d16) + (a << 12)
-        a = (a ^ 0xc761c23c) ^ (a >> 19)
-        a = (a + 0x165667b1) + (a << 5)
-        a = (a + 0xd3a2646c) ^ (a << 9)
-        a = (a + 0xfd7046c5) + (a << 3)
-        a = (a ^ 0xb55a4f09) ^ (a >> 16)
-        return a
+        as the key in a dict or set. The only real requirement is that the
+        hash of equal objects must be equal, so it is the hash of the
+        event's identity, which spreads events at the same tick over
+        different hashes.
+        '''
+        identity = self.identity() if usesIdentity(type(self)) else None
+        if identity is None:
+            identity = (self.evtname, self.tick)
+        return hash(identity)
+
+    def serialize(self, previous_event_tick):
+        """Return a bytestring representation of the event, in the format required for
+        writing into a standard midi file.
+
+        The built in events implement ``serialize_into()``, which appends the
+        event to a ``bytearray``. A whole track is serialized into one
+        ``bytearray`` that way, so this is just a convenience.
+        """
+        midibytes = bytearray()
+        self.serialize_into(midibytes, previous_event_tick)
+        return bytes(midibytes)
+
+    def serialize_into(self, midibytes, previous_event_tick):
+        """Append the serialized event to the ``bytearray`` midibytes.
+
+        Derived classes override either this or ``serialize()``. This
+        default appends what ``serialize()`` returns, so an event which only
+        defines ``serialize()`` is written too.
+        """
+        serialize = type(self).serialize
+        if getattr(serialize, '__func__', serialize) is GenericEvent.__dict__['serialize']:
+            raise NotImplementedError("%s defines neither serialize() nor serialize_into()" %
+                                      type(self).__name__)
+        midibytes += self.serialize(previous_event_tick)
 
 
 class NoteOn(GenericEvent):
     '''
     A class that encapsulates a note
     '''
+    __slots__ = ('pitch', 'duration', 'volume', 'channel', 'annotation')
     evtname = 'NoteOn'
     midi_status = 0x90    # 0x9x is Note On
     sec_sort_order = 3
@@ -107,29 +169,30 @@ class NoteOn(GenericEvent):
     # because in Python 3 parent __hash__ is not inherited.
     __hash__ = GenericEvent.__hash__
 
+    def identity(self):
+        return (self.evtname, self.tick, self.pitch, self.channel)
+
     def __str__(self):
         return 'NoteOn %d at tick %d duration %d ch %d vel %d' % (
             self.pitch, self.tick, self.duration, self.channel, self.volume)
 
-    def serialize(self, previous_event_tick):
-        """Return a bytestring representation of the event, in the format required for
-        writing into a standard midi file.
+    def serialize_into(self, midibytes, previous_event_tick):
+        """Append a bytestring representation of the event to ``midibytes`` (a
+        ``bytearray``), in the format required for writing into a standard midi file.
         """
-        midibytes = b""
-        code = self.midi_status | self.channel
-        varTime = writeVarLength(self.tick - previous_event_tick)
-        for timeByte in varTime:
-            midibytes += struct.pack('>B', timeByte)
-        midibytes += struct.pack('>B', code)
-        midibytes += struct.pack('>B', self.pitch)
-        midibytes += struct.pack('>B', self.volume)
-        return midibytes
+        delta = self.tick - previous_event_tick
+        if 0 <= delta < 0x80:
+            midibytes += packNote(delta, self.midi_status | self.channel, self.pitch, self.volume)
+        else:
+            midibytes += packVarLength(delta)
+            midibytes += packChannel3(self.midi_status | self.channel, self.pitch, self.volume)
 
 
 class NoteOff (GenericEvent):
     '''
     A class that encapsulates a Note Off event
     '''
+    __slots__ = ('pitch', 'volume', 'channel', 'annotation')
     evtname = 'NoteOff'
     midi_status = 0x80  # 0x8x is Note Off
     sec_sort_order = 2  # must be less than that of NoteOn
@@ -152,29 +215,41 @@ class NoteOff (GenericEvent):
 
     __hash__ = GenericEvent.__hash__
 
+    def identity(self):
+        return (self.evtname, self.tick, self.pitch, self.channel)
+
     def __str__(self):
         return 'NoteOff %d at tick %d ch %d vel %d' % (
             self.pitch, self.tick, self.channel, self.volume)
 
-    def serialize(self, previous_event_tick):
-        """Return a bytestring representation of the event, in the format required for
-        writing into a standard midi file.
+    def serialize_into(self, midibytes, previous_event_tick):
+        """Append a bytestring representation of the event to ``midibytes`` (a
+        ``bytearray``), in the format required for writing into a standard midi file.
         """
-        midibytes = b""
-        code = self.midi_status | self.channel
-        varTime = writeVarLength(self.tick - previous_event_tick)
-        for timeByte in varTime:
-            midibytes += struct.pack('>B', timeByte)
-        midibytes += struct.pack('>B', code)
-        midibytes += struct.pack('>B', self.pitch)
-        midibytes += struct.pack('>B', self.volume)
-        return midibytes
+        delta = self.tick - previous_event_tick
+        if 0 <= delta < 0x80:
+            midibytes += packNote(delta, self.midi_status | self.channel, self.pitch, self.volume)
+        else:
+            midibytes += packVarLength(delta)
+            midibytes += packChannel3(self.midi_status | self.channel, self.pitch, self.volume)
+
+    def serialize_as_note_on_into(self, midibytes, previous_event_tick):
+        """Append the event to ``midibytes`` as a note on with velocity zero,
+        which MIDI treats as a note off. The note off velocity is lost.
+        """
+        delta = self.tick - previous_event_tick
+        if 0 <= delta < 0x80:
+            midibytes += packNote(delta, NoteOn.midi_status | self.channel, self.pitch, 0)
+        else:
+            midibytes += packVarLength(delta)
+            midibytes += packChannel3(NoteOn.midi_status | self.channel, self.pitch, 0)
 
 
 class Tempo(GenericEvent):
     '''
     A class that encapsulates a tempo meta-event
     '''
+    __slots__ = ('tempo',)
     evtname = 'Tempo'
     sec_sort_order = 3
 
@@ -189,9 +264,12 @@ class Tempo(GenericEvent):
 
     __hash__ = GenericEvent.__hash__
 
-    def serialize(self, previous_event_tick):
-        """Return a bytestring representation of the event, in the format required for
-        writing into a standard midi file.
+    def identity(self):
+        return (self.evtname, self.tick, self.tempo)
+
+    def serialize_into(self, midibytes, previous_event_tick):
+        """Append a bytestring representation of the event to ``midibytes`` (a
+        ``bytearray``), in the format required for writing into a standard midi file.
         """
         # Standard MIDI File Format says:
         #
@@ -212,25 +290,17 @@ class Tempo(GenericEvent):
         # Six identical lower-case letters such as tttttt refer to a 24-bit value, stored
         # most-significant-byte first. The notation len refers to the
 
-        midibytes = b""
-        code = 0xFF
-        subcode = 0x51
-        fourbite = struct.pack('>L', self.tempo)  # big-endian uint32
-        threebite = fourbite[1:4]  # Just discard the MSB
-        varTime = writeVarLength(self.tick - previous_event_tick)
-        for timeByte in varTime:
-            midibytes += struct.pack('>B', timeByte)
-        midibytes += struct.pack('>B', code)
-        midibytes += struct.pack('>B', subcode)
-        midibytes += struct.pack('>B', 0x03)  # length in bytes of 24-bit tempo
-        midibytes += threebite
-        return midibytes
+        midibytes += packVarLength(self.tick - previous_event_tick)
+        # 0x03 is the length in bytes of the 24-bit tempo, which takes the
+        # place of the tempo's (discarded) most significant byte
+        midibytes += packTempo(0xFF, 0x51, 0x03000000 | (self.tempo & 0xFFFFFF))
 
 
 class Copyright(GenericEvent):
     '''
     A class that encapsulates a copyright event
     '''
+    __slots__ = ('notice',)
     evtname = 'Copyright'
     sec_sort_order = 1
 
@@ -238,9 +308,9 @@ class Copyright(GenericEvent):
         self.notice = notice.encode("ISO-8859-1")
         super(Copyright, self).__init__(tick, insertion_order)
 
-    def serialize(self, previous_event_tick):
-        """Return a bytestring representation of the event, in the format required for
-        writing into a standard midi file.
+    def serialize_into(self, midibytes, previous_event_tick):
+        """Append a bytestring representation of the event to ``midibytes`` (a
+        ``bytearray``), in the format required for writing into a standard midi file.
         """
         # Standard MIDI File Format says:
         #
@@ -251,26 +321,17 @@ class Copyright(GenericEvent):
         # File, all of the copyright notices should be placed together in this
         # event so that it will be at the beginning of the file. This event
         # should be the first event in the track chunk, at tick 0.
-        midibytes = b""
-        code = 0xFF
-        subcode = 0x02
-        varTime = writeVarLength(self.tick - previous_event_tick)
-        for timeByte in varTime:
-            midibytes += struct.pack('>B', timeByte)
-        midibytes += struct.pack('>B', code)
-        midibytes += struct.pack('>B', subcode)
-        payloadLength = len(self.notice)
-        payloadLengthVar = writeVarLength(payloadLength)
-        for i in payloadLengthVar:
-            midibytes += struct.pack("b", i)
+        midibytes += packVarLength(self.tick - previous_event_tick)
+        midibytes += packMeta(0xFF, 0x02)
+        midibytes += packVarLength(len(self.notice))
         midibytes += self.notice
-        return midibytes
 
 
 class Text(GenericEvent):
     '''
     A class that encapsulates a text event
     '''
+    __slots__ = ('text',)
     evtname = 'Text'
     sec_sort_order = 1
 
@@ -278,30 +339,21 @@ class Text(GenericEvent):
         self.text = text.encode("ISO-8859-1")
         super(Text, self).__init__(tick, insertion_order)
 
-    def serialize(self, previous_event_tick):
-        """Return a bytestring representation of the event, in the format required for
-        writing into a standard midi file.
+    def serialize_into(self, midibytes, previous_event_tick):
+        """Append a bytestring representation of the event to ``midibytes`` (a
+        ``bytearray``), in the format required for writing into a standard midi file.
         """
-        midibytes = b""
-        code = 0xFF
-        subcode = 0x01
-        varTime = writeVarLength(self.tick - previous_event_tick)
-        for timeByte in varTime:
-            midibytes += struct.pack('>B', timeByte)
-        midibytes += struct.pack('>B', code)
-        midibytes += struct.pack('>B', subcode)
-        payloadLength = len(self.text)
-        payloadLengthVar = writeVarLength(payloadLength)
-        for i in payloadLengthVar:
-            midibytes += struct.pack("B", i)
+        midibytes += packVarLength(self.tick - previous_event_tick)
+        midibytes += packMeta(0xFF, 0x01)
+        midibytes += packVarLength(len(self.text))
         midibytes += self.text
-        return midibytes
 
 
 class KeySignature(GenericEvent):
     '''
     A class that encapsulates a text event
     '''
+    __slots__ = ('accidentals', 'accidental_type', 'mode')
     evtname = 'KeySignature'
     sec_sort_order = 1
 
@@ -312,29 +364,22 @@ class KeySignature(GenericEvent):
         self.mode = mode
         super(KeySignature, self).__init__(tick, insertion_order)
 
-    def serialize(self, previous_event_tick):
-        """Return a bytestring representation of the event, in the format required for
-        writing into a standard midi file.
+    def serialize_into(self, midibytes, previous_event_tick):
+        """Append a bytestring representation of the event to ``midibytes`` (a
+        ``bytearray``), in the format required for writing into a standard midi file.
         """
-        midibytes = b""
-        code = 0xFF
-        subcode = 0x59
-        event_subtype = 0x02
-        varTime = writeVarLength(self.tick - previous_event_tick)
-        for timeByte in varTime:
-            midibytes += struct.pack('>B', timeByte)
-        midibytes += struct.pack('>B', code)
-        midibytes += struct.pack('>B', subcode)
-        midibytes += struct.pack('>B', event_subtype)
-        midibytes += struct.pack('>b', self.accidentals * self.accidental_type)
-        midibytes += struct.pack('>B', self.mode)
-        return midibytes
+        midibytes += packVarLength(self.tick - previous_event_tick)
+        # The number of accidentals is signed: negative for flats
+        midibytes += packKeySignature(0xFF, 0x59, 0x02,
+                                      (self.accidentals * self.accidental_type) & 0xFF,
+                                      self.mode)
 
 
 class ProgramChange(GenericEvent):
     '''
     A class that encapsulates a program change event.
     '''
+    __slots__ = ('programNumber', 'channel')
     evtname = 'ProgramChange'
     midi_status = 0xc0   # 0xcx is Program Change
     sec_sort_order = 1
@@ -353,24 +398,22 @@ class ProgramChange(GenericEvent):
 
     __hash__ = GenericEvent.__hash__
 
-    def serialize(self, previous_event_tick):
-        """Return a bytestring representation of the event, in the format required for
-        writing into a standard midi file.
+    def identity(self):
+        return (self.evtname, self.tick, self.programNumber, self.channel)
+
+    def serialize_into(self, midibytes, previous_event_tick):
+        """Append a bytestring representation of the event to ``midibytes`` (a
+        ``bytearray``), in the format required for writing into a standard midi file.
         """
-        midibytes = b""
-        code = self.midi_status | self.channel
-        varTime = writeVarLength(self.tick)
-        for timeByte in varTime:
-            midibytes += struct.pack('>B', timeByte)
-        midibytes += struct.pack('>B', code)
-        midibytes += struct.pack('>B', self.programNumber)
-        return midibytes
+        midibytes += packVarLength(self.tick - previous_event_tick)
+        midibytes += packChannel2(self.midi_status | self.channel, self.programNumber)
 
 
 class SysExEvent(GenericEvent):
     '''
     A class that encapsulates a System Exclusive  event.
     '''
+    __slots__ = ('manID', 'payload')
     evtname = 'SysEx'  # doesn't match class name like most others
     sec_sort_order = 1
 
@@ -384,31 +427,26 @@ class SysExEvent(GenericEvent):
 
     __hash__ = GenericEvent.__hash__
 
-    def serialize(self, previous_event_tick):
-        """Return a bytestring representation of the event, in the format required for
-        writing into a standard midi file.
-        """
-        midibytes = b""
-        code = 0xF0
-        varTime = writeVarLength(self.tick - previous_event_tick)
-        for timeByte in varTime:
-            midibytes += struct.pack('>B', timeByte)
-        midibytes += struct.pack('>B', code)
+    def identity(self):
+        return None
 
-        payloadLength = writeVarLength(len(self.payload) + 2)
-        for lenByte in payloadLength:
-            midibytes += struct.pack('>B', lenByte)
-
-        midibytes += struct.pack('>B', self.manID)
+    def serialize_into(self, midibytes, previous_event_tick):
+        """Append a bytestring representation of the event to ``midibytes`` (a
+        ``bytearray``), in the format required for writing into a standard midi file.
+        """
+        midibytes += packVarLength(self.tick - previous_event_tick)
+        midibytes.append(0xF0)
+        midibytes += packVarLength(len(self.payload) + 2)
+        midibytes.append(self.manID)
         midibytes += self.payload
-        midibytes += struct.pack('>B', 0xF7)
-        return midibytes
+        midibytes.append(0xF7)
 
 
 class UniversalSysExEvent(GenericEvent):
     '''
     A class that encapsulates a Universal System Exclusive  event.
     '''
+    __slots__ = ('realTime', 'sysExChannel', 'code', 'subcode', 'payload')
     evtname = 'UniversalSysEx'  # doesn't match class name like most others
     sec_sort_order = 1
 
@@ -426,39 +464,30 @@ class UniversalSysExEvent(GenericEvent):
 
     __hash__ = GenericEvent.__hash__
 
-    def serialize(self, previous_event_tick):
-        """Return a bytestring representation of the event, in the format required for
-        writing into a standard midi file.
+    def identity(self):
+        return None
+
+    def serialize_into(self, midibytes, previous_event_tick):
+        """Append a bytestring representation of the event to ``midibytes`` (a
+        ``bytearray``), in the format required for writing into a standard midi file.
         """
-        midibytes = b""
-        code = 0xF0
-        varTime = writeVarLength(self.tick - previous_event_tick)
-        for timeByte in varTime:
-            midibytes += struct.pack('>B', timeByte)
-        midibytes += struct.pack('>B', code)
+        midibytes += packVarLength(self.tick - previous_event_tick)
+        midibytes.append(0xF0)
 
         # Do we need to add a length?
-        payloadLength = writeVarLength(len(self.payload) + 5)
-        for lenByte in payloadLength:
-            midibytes += struct.pack('>B', lenByte)
-
-        if self.realTime:
-            midibytes += struct.pack('>B', 0x7F)
-        else:
-            midibytes += struct.pack('>B', 0x7E)
+        midibytes += packVarLength(len(self.payload) + 5)
 
-        midibytes += struct.pack('>B', self.sysExChannel)
-        midibytes += struct.pack('>B', self.code)
-        midibytes += struct.pack('>B', self.subcode)
+        midibytes += packUniversalSysEx(0x7F if self.realTime else 0x7E,
+                                        self.sysExChannel, self.code, self.subcode)
         midibytes += self.payload
-        midibytes += struct.pack('>B', 0xF7)
-        return midibytes
+        midibytes.append(0xF7)
 
 
 class ControllerEvent(GenericEvent):
     '''
     A class that encapsulates a program change event.
     '''
+    __slots__ = ('parameter', 'channel', 'controller_number')
     evtname = 'ControllerEvent'
     midi_status = 0xB0  # 0xBx is Control Change
     sec_sort_order = 1
@@ -475,25 +504,22 @@ class ControllerEvent(GenericEvent):
 
     __hash__ = GenericEvent.__hash__
 
-    def serialize(self, previous_event_tick):
-        """Return a bytestring representation of the event, in the format required for
-        writing into a standard midi file.
+    def identity(self):
+        return None
+
+    def serialize_into(self, midibytes, previous_event_tick):
+        """Append a bytestring representation of the event to ``midibytes`` (a
+        ``bytearray``), in the format required for writing into a standard midi file.
         """
-        midibytes = b""
-        code = self.midi_status | self.channel
-        varTime = writeVarLength(self.tick - previous_event_tick)
-        for timeByte in varTime:
-            midibytes += struct.pack('>B', timeByte)
-        midibytes += struct.pack('>B', code)
-        midibytes += struct.pack('>B', self.controller_number)
-        midibytes += struct.pack('>B', self.parameter)
-        return midibytes
+        midibytes += packVarLength(self.tick - previous_event_tick)
+        midibytes += packChannel3(self.midi_status | self.channel, self.controller_number, self.parameter)
 
 
 class ChannelPressureEvent(GenericEvent):
     '''
     A class that encapsulates a Channel Pressure (Aftertouch) event.
     '''
+    __slots__ = ('channel', 'pressure_value')
     evtname = 'ChannelPressure'
     midi_status = 0xD0  # 0xDx is Channel Pressure (Aftertouch)
     sec_sort_order = 1
@@ -511,24 +537,22 @@ class ChannelPressureEvent(GenericEvent):
 
     __hash__ = GenericEvent.__hash__
 
-    def serialize(self, previous_event_tick):
-        """Return a bytestring representation of the event, in the format required for
-        writing into a standard midi file.
+    def identity(self):
+        return (self.evtname, self.tick, self.pressure_value, self.channel)
+
+    def serialize_into(self, midibytes, previous_event_tick):
+        """Append a bytestring representation of the event to ``midibytes`` (a
+        ``bytearray``), in the format required for writing into a standard midi file.
         """
-        midibytes = b""
-        code = self.midi_status | self.channel
-        vartick = writeVarLength(self.tick - previous_event_tick)
-        for x in vartick:
-            midibytes += struct.pack('>B', x)
-        midibytes += struct.pack('>B', code)
-        midibytes += struct.pack('>B', self.pressure_value)
-        return midibytes
+        midibytes += packVarLength(self.tick - previous_event_tick)
+        midibytes += packChannel2(self.midi_status | self.channel, self.pressure_value)
 
 
 class PitchWheelEvent(GenericEvent):
     '''
     A class that encapsulates a pitch wheel change event.
     '''
+    __slots__ = ('channel', 'pitch_wheel_value')
     evtname = 'PitchWheelEvent'
     midi_status = 0xE0  # 0xEx is Pitch Wheel Change
     sec_sort_order = 1
@@ -543,27 +567,24 @@ class PitchWheelEvent(GenericEvent):
 
     __hash__ = GenericEvent.__hash__
 
-    def serialize(self, previous_event_tick):
-        """Return a bytestring representation of the event, in the format required for
-        writing into a standard midi file.
+    def identity(self):
+        return None
+
+    def serialize_into(self, midibytes, previous_event_tick):
+        """Append a bytestring representation of the event to ``midibytes`` (a
+        ``bytearray``), in the format required for writing into a standard midi file.
         """
-        midibytes = b""
-        code = self.midi_status | self.channel
-        varTime = writeVarLength(self.tick - previous_event_tick)
-        for timeByte in varTime:
-            midibytes = midibytes + struct.pack('>B', timeByte)
+        midibytes += packVarLength(self.tick - previous_event_tick)
         MSB = (self.pitch_wheel_value + 8192) >> 7
         LSB = (self.pitch_wheel_value + 8192) & 0x7F
-        midibytes = midibytes + struct.pack('>B', code)
-        midibytes = midibytes + struct.pack('>B', LSB)
-        midibytes = midibytes + struct.pack('>B', MSB)
-        return midibytes
+        midibytes += packChannel3(self.midi_status | self.channel, LSB, MSB)
 
 
 class TrackName(GenericEvent):
     '''
     A class that encapsulates a program change event.
     '''
+    __slots__ = ('trackName',)
     evtname = 'TrackName'
     sec_sort_order = 0
 
@@ -579,28 +600,24 @@ class TrackName(GenericEvent):
 
     __hash__ = GenericEvent.__hash__
 
-    def serialize(self, previous_event_tick):
-        """Return a bytestring representation of the event, in the format required for
-        writing into a standard midi file.
+    def identity(self):
+        return (self.evtname, self.tick, self.trackName)
+
+    def serialize_into(self, midibytes, previous_event_tick):
+        """Append a bytestring representation of the event to ``midibytes`` (a
+        ``bytearray``), in the format required for writing into a standard midi file.
         """
-        midibytes = b""
-        varTime = writeVarLength(self.tick - previous_event_tick)
-        for timeByte in varTime:
-            midibytes += struct.pack('>B', timeByte)
-        midibytes += struct.pack('B', 0xFF)
-        midibytes += struct.pack('B', 0X03)
-        dataLength = len(self.trackName)
-        dataLengthVar = writeVarLength(dataLength)
-        for i in dataLengthVar:
-            midibytes += struct.pack("B", i)
+        midibytes += packVarLength(self.tick - previous_event_tick)
+        midibytes += packMeta(0xFF, 0x03)
+        midibytes += packVarLength(len(self.trackName))
         midibytes += self.trackName
-        return midibytes
 
 
 class TimeSignature(GenericEvent):
     '''
     A class that encapsulates a time signature.
     '''
+    __slots__ = ('numerator', 'denominator', 'clocks_per_tick', 'notes_per_quarter')
     evtname = 'TimeSignature'
     sec_sort_order = 0
 
@@ -612,25 +629,114 @@ class TimeSignature(GenericEvent):
         self.notes_per_quarter = notes_per_quarter
         super(TimeSignature, self).__init__(tick, insertion_order)
 
-    def serialize(self, previous_event_tick):
-        """Return a bytestring representation of the event, in the format required for
-        writing into a standard midi file.
+    def serialize_into(self, midibytes, previous_event_tick):
+        """Append a bytestring representation of the event to ``midibytes`` (a
+        ``bytearray``), in the format required for writing into a standard midi file.
         """
-        midibytes = b""
-        code = 0xFF
-        subcode = 0x58
-        varTime = writeVarLength(self.tick - previous_event_tick)
-        for timeByte in varTime:
-            midibytes += struct.pack('>B', timeByte)
-        midibytes += struct.pack('>B', code)
-        midibytes += struct.pack('>B', subcode)
-        midibytes += struct.pack('>B', 0x04)
-        midibytes += struct.pack('>B', self.numerator)
-        midibytes += struct.pack('>B', self.denominator)
-        midibytes += struct.pack('>B', self.clocks_per_tick)
-        # 32nd notes per quarter note
-        midibytes += struct.pack('>B', self.notes_per_quarter)
-        return midibytes
+        midibytes += packVarLength(self.tick - previous_event_tick)
+        # The last byte is the number of 32nd notes per quarter note
+        midibytes += packTimeSignature(0xFF, 0x58, 0x04, self.numerator, self.denominator,
+                                       self.clocks_per_tick, self.notes_per_quarter)
+
+
+class NoteColumns(object):
+    '''
+    The notes of a track, held in parallel arrays rather than as
+    :class:`NoteOn` and :class:`NoteOff` objects.
+
+    Note ``i`` starts at ``ticks[i]`` and lasts ``durations[i]`` ticks. Its
+    NoteOff event is not stored, but derived when the track is closed.
+    Annotations are kept in a dict keyed by note index, and only for notes
+    which have one.
+    '''
+    __slots__ = ('ticks', 'durations', 'pitches', 'channels', 'volumes',
+                 'orders', 'annotations')
+
+    def __init__(self):
+        self.ticks = array('l')
+        self.durations = array('l')
+        self.pitches = array('B')
+        self.channels = array('B')
+        self.volumes = array('B')
+        self.orders = array('l')
+        self.annotations = {}
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def append(self, channel, pitch, tick, duration, volume, annotation,
+               insertion_order):
+        if annotation is not None:
+            self.annotations[len(self.ticks)] = annotation
+        self.ticks.append(tick)
+        self.durations.append(duration)
+        self.pitches.append(pitch)
+        self.channels.append(channel)
+        self.volumes.append(volume)
+        self.orders.append(insertion_order)
+
+    def extend(self, channels, pitches, ticks, durations, volumes,
+               insertion_order):
+        '''
+        Append many notes at once. The arguments are iterables of the same
+        length, and the notes take consecutive insertion orders starting at
+        ``insertion_order``.
+        '''
+        count = len(ticks)
+        self.ticks.extend(ticks)
+        self.durations.extend(durations)
+        self.pitches.extend(pitches)
+        self.channels.extend(channels)
+        self.volumes.extend(volumes)
+        self.orders.extend(range(insertion_order, insertion_order + count))
+
+
+class EventKeys(object):
+    '''
+    Packs the sort key of an event -- its tick, ``sec_sort_order`` and
+    ``insertion_order``, and a number identifying it -- into one integer,
+    which sorts in the same order as the tuple of those values would.
+
+    :param lowest_tick: The lowest tick of any of the events.
+    :param highest_order: The highest ``insertion_order`` of any of them.
+    :param count: The number of events, which are numbered from zero.
+    :param sec_sort_orders: The ``sec_sort_order`` of each kind of event.
+
+    A ``sec_sort_order`` may be any number (a derived event's need not be one
+    of the built in 0 to 3), so it is its rank among ``sec_sort_orders``,
+    given by ``sec_ranks``, which is packed.
+    '''
+    __slots__ = ('lowest_tick', 'order_shift', 'sec_shift', 'tick_shift', 'code_mask', 'sec_ranks')
+
+    def __init__(self, lowest_tick, highest_order, count, sec_sort_orders):
+        self.sec_ranks = dict((order, rank) for (rank, order) in enumerate(sorted(set(sec_sort_orders))))
+        self.lowest_tick = lowest_tick
+        self.order_shift = count.bit_length()
+        self.sec_shift = self.order_shift + max(highest_order, 0).bit_length()
+        self.tick_shift = self.sec_shift + max(len(self.sec_ranks) - 1, 0).bit_length()
+        self.code_mask = (1 << self.order_shift) - 1
+
+    def pack(self, tick, sec_rank, insertion_order, code):
+        '''
+        Return the key of an event, given the rank in ``sec_ranks`` of its
+        ``sec_sort_order``.
+        '''
+        return ((tick - self.lowest_tick) << self.tick_shift |
+                sec_rank << self.sec_shift |
+                insertion_order << self.order_shift | code)
+
+    def unpack(self, key):
+        '''
+        Return the tick and number of the event with the key ``key``.
+        '''
+        return ((key >> self.tick_shift) + self.lowest_tick, key & self.code_mask)
+
+    def retick(self, key, tick):
+        '''
+        Return ``key`` with the event moved to ``tick``.
+        '''
+        return ((tick - self.lowest_tick) << self.tick_shift |
+                key & ((1 << self.tick_shift) - 1))
 
 
 class MIDITrack(object):
@@ -638,33 +744,86 @@ class MIDITrack(object):
     A class that encapsulates a MIDI track
     '''
 
-    def __init__(self, removeDuplicates, deinterleave):
+    def __init__(self, removeDuplicates, deinterleave, columnar=False,
+                 running_status=False, zero_velocity_note_off=False):
         '''Initialize the MIDITrack object.
         '''
         self.headerString = struct.pack('cccc', b'M', b'T', b'r', b'k')
         self.dataLength = 0  # Is calculated after the data is in place
         self.MIDIdata = b""
+        # The track is closed once its MIDIEventList is up to date with the
+        # eventList. Adding an event reopens it. The MIDIdata is kept until
+        # the track changes (see hasChanged()) or is written relative to a
+        # different origin.
         self.closed = False
+        self.closedLength = 0  # The length of the eventList when closed
+        self.origin = 0
+        self.dataOrigin = None
         self.eventList = []
         self.MIDIEventList = []
         self.remdep = removeDuplicates
         self.deinterleave = deinterleave
+        # In a columnar track the notes are kept in self.notes rather than in
+        # the eventList, and closing the track merges them with the
+        # MIDIEventList into streamTicks and streamEvents (see
+        # processNoteColumns()).
+        self.notes = NoteColumns() if columnar else None
+        self.streamTicks = array('l')
+        self.streamEvents = array('l')
+        self.running_status = running_status
+        self.zero_velocity_note_off = zero_velocity_note_off
+
+    def addEvent(self, event):
+        '''
+        Add an event to the eventList. The track will be closed again before
+        it is next written.
+        '''
+        self.eventList.append(event)
+        self.closed = False
 
     def addNoteByNumber(self, channel, pitch, tick, duration, volume,
                         annotation=None, insertion_order=0):
         '''
         Add a note by chromatic MIDI number
         '''
-        self.eventList.append(NoteOn(channel, pitch, tick, duration, volume,
-                                     annotation=annotation,
-                                     insertion_order=insertion_order))
+        if self.notes is not None:
+            self.notes.append(channel, pitch, tick, duration, volume,
+                              annotation, insertion_order)
+            self.closed = False
+            return
+
+        self.addEvent(NoteOn(channel, pitch, tick, duration, volume,
+                             annotation=annotation,
+                             insertion_order=insertion_order))
 
         # This event is not in chronological order. But before writing all the
         # events to the file, I sort self.eventlist on (tick, sec_sort_order, insertion_order)
         # which puts the events in chronological order.
-        self.eventList.append(NoteOff(channel, pitch, tick + duration, volume,
-                                      annotation=annotation,
-                                      insertion_order=insertion_order))
+        self.addEvent(NoteOff(channel, pitch, tick + duration, volume,
+                              annotation=annotation,
+                              insertion_order=insertion_order))
+
+    def addNotesByNumber(self, channels, pitches, ticks, durations, volumes,
+                         insertion_order=0):
+        '''
+        Add many notes by chromatic MIDI number. The arguments are iterables
+        of the same length as ``ticks``, and the notes take consecutive
+        insertion orders starting at ``insertion_order``.
+        '''
+        self.closed = False
+        if self.notes is not None:
+            self.notes.extend(channels, pitches, ticks, durations, volumes,
+                              insertion_order)
+            return
+
+        eventList = self.eventList
+        for (order, channel, pitch, tick, duration, volume) in zip(
+                range(insertion_order, insertion_order + len(ticks)),
+                channels, pitches, ticks, durations, volumes):
+            eventList.append(NoteOn(channel, pitch, tick, duration, volume,
+                                    insertion_order=order))
+            eventList.append(NoteOff(channel, pitch, tick + duration, volume,
+                                     insertion_order=order))
 
     def addControllerEvent(self, channel, tick, controller_number, parameter,
                            insertion_order=0):
@@ -672,29 +831,29 @@ class MIDITrack(object):
         Add a controller event.
         '''
 
-        self.eventList.append(ControllerEvent(channel, tick, controller_number,
-                                              parameter,
-                                              insertion_order=insertion_order))
+        self.addEvent(ControllerEvent(channel, tick, controller_number,
+                                      parameter,
+                                      insertion_order=insertion_order))
 
     def addPitchWheelEvent(self, channel, tick, pitch_wheel_value, insertion_order=0):
         '''
         Add a pitch wheel event.
         '''
-        self.eventList.append(PitchWheelEvent(channel, tick, pitch_wheel_value, insertion_order=insertion_order))
+        self.addEvent(PitchWheelEvent(channel, tick, pitch_wheel_value, insertion_order=insertion_order))
 
     def addTempo(self, tick, tempo, insertion_order=0):
         '''
         Add a tempo change (or set) event.
         '''
-        self.eventList.append(Tempo(tick, tempo,
-                                    insertion_order=insertion_order))
+        self.addEvent(Tempo(tick, tempo,
+                            insertion_order=insertion_order))
 
     def addSysEx(self, tick, manID, payload, insertion_order=0):
         '''
         Add a SysEx event.
         '''
-        self.eventList.append(SysExEvent(tick, manID, payload,
-                                         insertion_order=insertion_order))
+        self.addEvent(SysExEvent(tick, manID, payload,
+                                 insertion_order=insertion_order))
 
     def addUniversalSysEx(self, tick, code, subcode, payload,
                           sysExChannel=0x7F, realTime=False,
@@ -702,78 +861,76 @@ class MIDITrack(object):
         '''
         Add a Universal SysEx event.
         '''
-        self.eventList.append(UniversalSysExEvent(tick, realTime, sysExChannel,
-                              code, subcode, payload,
-                              insertion_order=insertion_order))
+        self.addEvent(UniversalSysExEvent(tick, realTime, sysExChannel,
+                      code, subcode, payload,
+                      insertion_order=insertion_order))
 
     def addProgramChange(self, channel, tick, program, insertion_order=0):
         '''
         Add a program change event.
         '''
-        self.eventList.append(ProgramChange(channel, tick, program,
-                                            insertion_order=insertion_order))
+        self.addEvent(ProgramChange(channel, tick, program,
+                                    insertion_order=insertion_order))
 
     def addChannelPressure(self, channel, tick, pressure_value, insertion_order=0):
         '''
         Add a channel pressure event.
         '''
-        self.eventList.append(ChannelPressureEvent(channel, tick, pressure_value,
-                                                   insertion_order=insertion_order))
+        self.addEvent(ChannelPressureEvent(channel, tick, pressure_value,
+                                           insertion_order=insertion_order))
 
     def addTrackName(self, tick, trackName, insertion_order=0):
         '''
         Add a track name event.
         '''
-        self.eventList.append(TrackName(tick, trackName,
-                                        insertion_order=insertion_order))
+        self.addEvent(TrackName(tick, trackName,
+                                insertion_order=insertion_order))
 
     def addTimeSignature(self, tick, numerator, denominator, clocks_per_tick,
                          notes_per_quarter, insertion_order=0):
         '''
         Add a time signature.
         '''
-        self.eventList.append(TimeSignature(tick, numerator, denominator,
-                                            clocks_per_tick, notes_per_quarter,
-                                            insertion_order=insertion_order))
+        self.addEvent(TimeSignature(tick, numerator, denominator,
+                                    clocks_per_tick, notes_per_quarter,
+                                    insertion_order=insertion_order))
 
     def addCopyright(self, tick, notice, insertion_order=0):
         '''
         Add a copyright notice
         '''
-        self.eventList.append(Copyright(tick, notice,
-                                        insertion_order=insertion_order))
+        self.addEvent(Copyright(tick, notice,
+                                insertion_order=insertion_order))
 
     def addKeySignature(self, tick, accidentals, accidental_type, mode,
                         insertion_order=0):
         '''
         Add a copyright notice
         '''
-        self.eventList.append(KeySignature(tick, accidentals, accidental_type,
-                                           mode,
-                                           insertion_order=insertion_order))
+        self.addEvent(KeySignature(tick, accidentals, accidental_type,
+                                   mode,
+                                   insertion_order=insertion_order))
 
     def addText(self, tick, text, insertion_order=0):
         '''
         Add a text event
         '''
-        self.eventList.append(Text(tick, text,
-                              insertion_order=insertion_order))
+        self.addEvent(Text(tick, text,
+                      insertion_order=insertion_order))
 
     def changeNoteTuning(self, tunings, sysExChannel=0x7F, realTime=True,
                          tuningProgam=0, insertion_order=0):
         '''
         Change the tuning of MIDI notes
         '''
-        payload = struct.pack('>B', tuningProgam)
-        payload = payload + struct.pack('>B', len(tunings))
+        payload = bytearray((tuningProgam, len(tunings)))
         for (noteNumber, frequency) in tunings:
-            payload = payload + struct.pack('>B', noteNumber)
-            MIDIFreqency = frequencyTransform(frequency)
-            for byte in MIDIFreqency:
-                payload = payload + struct.pack('>B', byte)
+            payload.append(noteNumber)
+            payload.extend(frequencyTransform(frequency))
+        payload = bytes(payload)
 
-        self.eventList.append(UniversalSysExEvent(0, realTime, sysExChannel,
-                              8, 2, payload, insertion_order=insertion_order))
+        self.addEvent(UniversalSysExEvent(0, realTime, sysExChannel,
+                      8, 2, payload, insertion_order=insertion_order))
 
     def processEventList(self):
         '''
@@ -781,9 +938,12 @@ class MIDITrack(object):
         which is then sorted to be in chronological order by start tick.
         '''
 
-        self.MIDIEventList = [evt for evt in self.eventList]
-        # Assumptions in the code expect the list to be time-sorted.
-        self.MIDIEventList.sort(key=sort_events)
+        # Assumptions in the code expect the list to be time-sorted. We want
+        # things like program changes to come before notes when they are at
+        # the same time, so the MIDI events are sorted by both their start
+        # time and a secondary ordinality defined for each kind of event.
+        # This is the only place the track is sorted.
+        self.MIDIEventList = sortEvents(self.eventList)
 
         if self.deinterleave:
             self.deInterleaveNotes()
@@ -797,13 +957,30 @@ class MIDITrack(object):
         otherwise.
         '''
 
-        # For this algorithm to work, the events in the eventList must be
-        # hashable (that is, they must have a __hash__() and __eq__() function
-        # defined).
+        # Events are duplicates if they have the same identity() (a tuple of
+        # their identifying attributes), so it is the identities which are
+        # kept in a set. Events without an identity, or whose class overrides
+        # __eq__() without overriding identity(), are kept in a set
+        # themselves, which compares them with __eq__(). The first of a set of
+        # duplicates is kept, and the order of the eventList is otherwise
+        # unchanged, so there is no need to sort.
 
-        s = set(self.eventList)
-        self.eventList = list(s)
-        self.eventList.sort(key=sort_events)
+        seen = set()
+        seenEvents = set()
+        tempEventList = []
+        for event in self.eventList:
+            identity = event.identity() if usesIdentity(type(event)) else None
+            if identity is None:
+                if event in seenEvents:
+                    continue
+                seenEvents.add(event)
+            else:
+                size = len(seen)
+                seen.add(identity)
+                if len(seen) == size:
+                    continue
+            tempEventList.append(event)
+        self.eventList = tempEventList
 
     def closeTrack(self):
         '''
@@ -813,47 +990,318 @@ class MIDITrack(object):
         prepare the actual data stream for writing. Duplicate events are
         removed from the eventList, and the MIDIEventList is created.
 
+        Nothing is done if the track has not changed since it was last
+        closed. Otherwise the MIDIEventList is created afresh, so events may
+        be added after the track is written, and it closed and written again.
+
         Called by the parent MIDIFile object.
         '''
 
-        if self.closed:
+        if not self.hasChanged():
             return
         self.closed = True
+        self.dataOrigin = None
 
         if self.remdep:
             self.removeDuplicates()
+        self.closedLength = len(self.eventList)
 
         self.processEventList()
 
+        if self.notes is not None:
+            self.processNoteColumns()
+
+    def hasChanged(self):
+        '''
+        Return ``True`` if the track has changed since it was last closed.
+
+        ``addEvent()`` and the other accessors reopen the track. Events
+        appended to the eventList directly are noticed too, as the length of
+        the eventList changes.
+        '''
+        return not self.closed or len(self.eventList) != self.closedLength
+
+    def processNoteColumns(self):
+        '''
+        Sort the notes held in columns, along with the NoteOff events derived
+        from them, and merge them with the MIDIEventList.
+
+        Duplicates are removed and notes deinterleaved just as they are for
+        note objects. The result is the pair of arrays ``streamTicks`` and
+        ``streamEvents``, which hold the tick and identity of every event in
+        the track in order. Event ``2 * i + 1`` is the NoteOn of note ``i``,
+        event ``2 * i`` its NoteOff, and a negative event ``~j`` is
+        ``MIDIEventList[j]``.
+
+        Rather than building a tuple per event to sort on, each event's
+        (tick, sec_sort_order, insertion_order, event) key is packed into a
+        single integer (see :class:`EventKeys`).
+        '''
+        notes = self.notes
+        channels = notes.channels
+        pitches = notes.pitches
+        events = self.MIDIEventList
+        ticks = notes.ticks
+        offTicks = array('l', [tick + duration for (tick, duration) in zip(ticks, notes.durations)])
+
+        if self.remdep:
+            # A note's channel and pitch take the low 16 bits of its key
+            ons = uniqueIndices([tick << 16 | channel << 8 | pitch
+                                 for (tick, channel, pitch) in zip(ticks, channels, pitches)])
+            offs = uniqueIndices([tick << 16 | channel << 8 | pitch
+                                  for (tick, channel, pitch) in zip(offTicks, channels, pitches)])
+        else:
+            ons = offs = range(len(notes))
+
+        eventTicks = [event.tick for event in events]
+        eventOrders = [event.insertion_order for event in events]
+        keys = EventKeys(min([0] + [min(a) for a in (ticks, offTicks, eventTicks) if len(a) > 0]),
+                         max([0] + [max(a) for a in (notes.orders, eventOrders) if len(a) > 0]),
+                         2 * len(notes) + len(events),
+                         [NoteOn.sec_sort_order, NoteOff.sec_sort_order] +
+                         [event.sec_sort_order for event in events])
+
+        orders = notes.orders
+        pack = keys.pack
+        secRank = keys.sec_ranks
+        (onRank, offRank) = (secRank[NoteOn.sec_sort_order], secRank[NoteOff.sec_sort_order])
+        noteEvents = [pack(ticks[i], onRank, orders[i], 2 * i + 1) for i in ons]
+        noteEvents.extend(pack(offTicks[i], offRank, orders[i], 2 * i) for i in offs)
+        noteEvents.sort()
+        ons = offs = offTicks = None
+
+        if self.deinterleave:
+            noteEvents = self.deInterleaveNoteColumns(noteEvents, keys)
+
+        # The MIDIEventList is already sorted. Events in it are numbered
+        # after the note events.
+        objectEvents = [pack(event.tick, secRank[event.sec_sort_order], event.insertion_order,
+                             2 * len(notes) + j)
+                        for (j, event) in enumerate(events)]
+
+        self.streamTicks = array('l')
+        self.streamEvents = array('l')
+        for key in heapq.merge(noteEvents, objectEvents):
+            (tick, code) = keys.unpack(key)
+            if code >= 2 * len(notes):
+                code = ~(code - 2 * len(notes))
+            self.streamTicks.append(tick)
+            self.streamEvents.append(code)
+
+    def deInterleaveNoteColumns(self, noteEvents, keys):
+        '''
+        Correct interleaved notes in a columnar track.
+
+        The same as deInterleaveNotes(), but working on the sorted list of
+        event keys built by processNoteColumns(). Returns the corrected list.
+        '''
+        channels = self.notes.channels
+        pitches = self.notes.pitches
+        stack = {}
+        movedIndices = []
+        moved = []
+
+        for (k, key) in enumerate(noteEvents):
+            (tick, code) = keys.unpack(key)
+            i = code >> 1
+            noteeventkey = channels[i] << 7 | pitches[i]
+            if code & 1:
+                stack.setdefault(noteeventkey, []).append(tick)
+            else:
+                onTicks = stack.get(noteeventkey)
+                if onTicks and len(onTicks) > 1:
+                    onTick = onTicks.pop()
+                    if onTick != tick:
+                        movedIndices.append(k)
+                        moved.append(keys.retick(key, onTick))
+                elif onTicks:
+                    onTicks.pop()
+
+        if not moved:
+            return noteEvents
+        moved.sort()
+        noteEvents = removeIndices(noteEvents, movedIndices)
+        return mergeSorted(noteEvents, noteEvents, moved, moved)
+
+    def firstTick(self):
+        '''
+        Return the tick of the first event of the closed track, or ``None`` if
+        the track is empty.
+        '''
+        if self.notes is not None:
+            return self.streamTicks[0] if len(self.streamTicks) > 0 else None
+        return self.MIDIEventList[0].tick if len(self.MIDIEventList) > 0 else None
+
     def writeMIDIStream(self):
         '''
         Write the meta data and note data to the packed MIDI stream.
+
+        The MIDIdata is only rebuilt if the track has been closed again, or
+        its origin has changed, since it was last written.
         '''
 
+        if self.dataOrigin == self.origin:
+            return
+        self.dataOrigin = self.origin
+
         # Process the events in the eventList
 
-        self.writeEventsToStream()
+        midibytes = bytearray()
+        self.writeEventsToStream(midibytes)
 
         # Write MIDI close event.
 
-        self.MIDIdata += struct.pack('BBBB', 0x00, 0xFF, 0x2F, 0x00)
+        midibytes.extend((0x00, 0xFF, 0x2F, 0x00))
+        self.MIDIdata = bytes(midibytes)
 
         # Calculate the entire length of the data and write to the header
 
         self.dataLength = struct.pack('>L', len(self.MIDIdata))
 
-    def writeEventsToStream(self):
+    def writeEventsToStream(self, midibytes, start=0, previous_event_tick=None,
+                            running=None):
         '''
         Write the events in MIDIEvents to the MIDI stream.
         MIDIEventList is presumed to be already sorted in chronological order.
+
+        :param midibytes: A ``bytearray`` which the events are appended to.
+        :param start: The first event to write, as numbered by
+            ``streamKeys()``. This, ``previous_event_tick`` and ``running``
+            (the running status) let ``MIDIFile.mergeTracks()`` write the rest
+            of a track into a stream which other events have been written to.
+
+        Event ticks are absolute. They are written as deltas from the
+        previous event, the first from the track's origin.
+
+        If the track uses running status, a channel event's status byte is
+        left out when it is the same as the one before (see
+        ``dropRunningStatus()``). Note offs may be written as note ons with
+        velocity zero, so that they share the note ons' running status.
         '''
-        previous_event_tick = 0
-        for event in self.MIDIEventList:
-            self.MIDIdata += event.serialize(previous_event_tick)
-            # previous_event_tick = event.tick
-            # I do not like that adjustTimeAndOrigin() changes GenericEvent.tick
-            # from absolute to relative. I intend to change that, and just
-            # calculate the relative tick here, without changing GenericEvent.tick
+        if previous_event_tick is None:
+            previous_event_tick = self.origin
+        if self.notes is not None:
+            self.writeNoteColumnsToStream(midibytes, start, previous_event_tick, running)
+            return
+
+        events = islice(self.MIDIEventList, start, None)
+        if self.running_status or self.zero_velocity_note_off:
+            running_status = self.running_status
+            zero_velocity_note_off = self.zero_velocity_note_off
+            for event in events:
+                start = len(midibytes)
+                if zero_velocity_note_off and event.evtname == 'NoteOff':
+                    event.serialize_as_note_on_into(midibytes, previous_event_tick)
+                else:
+                    event.serialize_into(midibytes, previous_event_tick)
+                if running_status:
+                    running = dropRunningStatus(midibytes, start, running)
+                previous_event_tick = event.tick
+            return
+
+        for event in events:
+            event.serialize_into(midibytes, previous_event_tick)
+            previous_event_tick = event.tick
+
+    def writeNoteColumnsToStream(self, midibytes, start, previous_event_tick, running):
+        '''
+        Write the events of a columnar track to the MIDI stream, packing the
+        notes directly from their columns. The arguments are as for
+        ``writeEventsToStream()``.
+        '''
+        channels = self.notes.channels
+        pitches = self.notes.pitches
+        volumes = self.notes.volumes
+        events = self.MIDIEventList
+        running_status = self.running_status  # If not, running stays None
+        zero_velocity_note_off = self.zero_velocity_note_off
+        noteOffStatus = NoteOn.midi_status if zero_velocity_note_off else NoteOff.midi_status
+
+        for (tick, code) in islice(zip(self.streamTicks, self.streamEvents), start, None):
+            if code < 0:
+                start = len(midibytes)
+                events[~code].serialize_into(midibytes, previous_event_tick)
+                if running_status:
+                    running = dropRunningStatus(midibytes, start, running)
+                previous_event_tick = tick
+                continue
+            delta = tick - previous_event_tick
+            previous_event_tick = tick
+            i = code >> 1
+            if code & 1:
+                status = NoteOn.midi_status | channels[i]
+                volume = volumes[i]
+            else:
+                status = noteOffStatus | channels[i]
+                volume = 0 if zero_velocity_note_off else volumes[i]
+            if status == running:
+                # The status byte is left out: delta, pitch, velocity
+                if 0 <= delta < 0x80:
+                    midibytes += packChannel3(delta, pitches[i], volume)
+                else:
+                    midibytes += packVarLength(delta)
+                    midibytes += packChannel2(pitches[i], volume)
+                continue
+            if 0 <= delta < 0x80:
+                midibytes += packNote(delta, status, pitches[i], volume)
+            else:
+                midibytes += packVarLength(delta)
+                midibytes += packChannel3(status, pitches[i], volume)
+            if running_status:
+                running = status
+
+    def streamKeys(self, index):
+        '''
+        Yield a ``(tick, sec_sort_order, insertion_order, index, k)`` tuple
+        for each event of the closed track, in the order they are written.
+        ``k`` numbers the events, for ``writeStreamItem()``, and ``index`` is
+        passed through, so the events of several tracks can be merged.
+        '''
+        events = self.MIDIEventList
+        if self.notes is None:
+            for (k, event) in enumerate(events):
+                yield (event.tick, event.sec_sort_order, event.insertion_order, index, k)
+            return
+
+        orders = self.notes.orders
+        for (k, (tick, code)) in enumerate(zip(self.streamTicks, self.streamEvents)):
+            if code < 0:
+                event = events[~code]
+                yield (tick, event.sec_sort_order, event.insertion_order, index, k)
+            elif code & 1:
+                yield (tick, NoteOn.sec_sort_order, orders[code >> 1], index, k)
+            else:
+                yield (tick, NoteOff.sec_sort_order, orders[code >> 1], index, k)
+
+    def writeStreamItem(self, midibytes, k, previous_event_tick):
+        '''
+        Write event ``k`` of the closed track (as numbered by
+        ``streamKeys()``) to the MIDI stream, with its status byte.
+        '''
+        if self.notes is None:
+            event = self.MIDIEventList[k]
+        else:
+            code = self.streamEvents[k]
+            if code >= 0:
+                i = code >> 1
+                if code & 1:
+                    status = NoteOn.midi_status
+                    volume = self.notes.volumes[i]
+                elif self.zero_velocity_note_off:
+                    status = NoteOn.midi_status
+                    volume = 0
+                else:
+                    status = NoteOff.midi_status
+                    volume = self.notes.volumes[i]
+                midibytes += packVarLength(self.streamTicks[k] - previous_event_tick)
+                midibytes += packChannel3(status | self.notes.channels[i], self.notes.pitches[i], volume)
+                return
+            event = self.MIDIEventList[~code]
+
+        if self.zero_velocity_note_off and event.evtname == 'NoteOff':
+            event.serialize_as_note_on_into(midibytes, previous_event_tick)
+        else:
+            event.serialize_into(midibytes, previous_event_tick)
 
     def deInterleaveNotes(self):
         '''
@@ -863,63 +1311,58 @@ class MIDITrack(object):
         can have notes which are interleaved with respect to their start
         and stop times. This method will correct that. It expects that the
         MIDIEventList has been time-ordered.
+
+        A NoteOff which has to move is replaced by a copy at its new time, so
+        the eventList is left as it was. The moved NoteOffs are merged back
+        into the MIDIEventList, which is not sorted again.
         '''
 
-        tempEventList = []
         stack = {}
-
-        for event in self.MIDIEventList:
-            if event.evtname in ['NoteOn', 'NoteOff']:
-                # !!! Pitch 101 channel 5 produces the same key as pitch 10 channel 15.
-                # !!! This is not the only pair of pitch,channel tuples which
-                # !!! collide to the same key, just one example.  Should fix by
-                # !!! putting a separator char between pitch and channel.
-                noteeventkey = str(event.pitch) + str(event.channel)
-                if event.evtname == 'NoteOn':
-                    if noteeventkey in stack:
-                        stack[noteeventkey].append(event.tick)
-                    else:
-                        stack[noteeventkey] = [event.tick]
-                    tempEventList.append(event)
-                elif event.evtname == 'NoteOff':
-                    if len(stack[noteeventkey]) > 1:
-                        event.tick = stack[noteeventkey].pop()
-                        tempEventList.append(event)
-                    else:
-                        stack[noteeventkey].pop()
-                        tempEventList.append(event)
-            else:
-                tempEventList.append(event)
-
-        self.MIDIEventList = tempEventList
+        movedIndices = []
+        moved = []
+
+        for (k, event) in enumerate(self.MIDIEventList):
+            evtname = event.evtname
+            if evtname == 'NoteOn':
+                noteeventkey = event.channel << 7 | event.pitch
+                if noteeventkey in stack:
+                    stack[noteeventkey].append(event.tick)
+                else:
+                    stack[noteeventkey] = [event.tick]
+            elif evtname == 'NoteOff':
+                onTicks = stack.get(event.channel << 7 | event.pitch)
+                if onTicks and len(onTicks) > 1:
+                    tick = onTicks.pop()
+                    if tick != event.tick:
+                        movedIndices.append(k)
+                        moved.append(NoteOff(event.channel, event.pitch, tick, event.volume,
+                                             annotation=event.annotation,
+                                             insertion_order=event.insertion_order))
+                elif onTicks:
+                    onTicks.pop()
+
+        if not moved:
+            return
 
         # Note NoteOff events have a lower secondary sort key than NoteOn
-        # events, so this sort will make concomitant NoteOff events
+        # events, so merging by sort key will make concomitant NoteOff events
         # processed first.
 
-        self.MIDIEventList.sort(key=sort_events)
+        moved.sort(key=sortKey)
+        events = removeIndices(self.MIDIEventList, movedIndices)
+        self.MIDIEventList = mergeSorted(events, list(map(sortKey, events)),
+                                         moved, list(map(sortKey, moved)))
 
     def adjustTimeAndOrigin(self, origin, adjust):
         '''
-        Adjust Times to be relative, and zero-origined.
+        Set the origin the track is written relative to.
 
-        If adjust is True, the track will be shifted. Regardelss times
-        are converted to relative values here.
+        If adjust is True, the track will be shifted so that ``origin`` is at
+        time zero. The events themselves are not changed: times are
+        converted to relative values as the track is written.
         '''
 
-        if len(self.MIDIEventList) == 0:
-            return
-        tempEventList = []
-        internal_origin = origin if adjust else 0
-        runningTick = 0
-
-        for event in self.MIDIEventList:
-            adjustedTick = event.tick - internal_origin
-            event.tick = adjustedTick - runningTick
-            runningTick = adjustedTick
-            tempEventList.append(event)
-
-        self.MIDIEventList = tempEventList
+        self.origin = origin if adjust else 0
 
     def writeTrack(self, fileHandle):
         '''
@@ -947,8 +1390,8 @@ class MIDIHeader(object):
         :param numTracks: The number of tracks the file contains. Integer,
             one or greater
         :param file_format: The format of the multi-track file. This should
-            either be ``1`` (the default, and the most widely supported
-            format) or ``2``.
+            be ``1`` (the default, and the most widely supported format),
+            ``2``, or ``0``.
         :param ticks_per_quarternote: The number of ticks per quarter
             note is what the Standard MIDI File Format Specification calls
             "division".  Ticks are the integer unit of time in the SMF, and in
@@ -983,7 +1426,8 @@ class MIDIFile(object):
 
     def __init__(self, numTracks=1, removeDuplicates=True, deinterleave=True,
                  adjust_origin=False, file_format=1,
-                 ticks_per_quarternote=TICKSPERQUARTERNOTE, eventtime_is_ticks=False):
+                 ticks_per_quarternote=TICKSPERQUARTERNOTE, eventtime_is_ticks=False,
+                 columnar=False, running_status=False, zero_velocity_note_off=False):
         '''Initialize the MIDIFile class
 
         :param numTracks: The number of tracks the file contains. Integer,
@@ -995,8 +1439,8 @@ class MIDIFile(object):
         :param adjust_origin: If set to ``True`` shift all the events in the tracks 
             so that the first event takes place at time t=0. Default is ``False``
         :param file_format: The format of the multi-track file. This should
-            either be ``1`` (the default, and the most widely supported
-            format) or ``2``.
+            be ``1`` (the default, and the most widely supported format),
+            ``2``, or ``0`` for a file of a single track.
         :param ticks_per_quarternote: The number of ticks per quarter note is
             what the Standard MIDI File Format Specification calls "division".
             Ticks are the integer unit of time in the SMF, and in most if
@@ -1007,6 +1451,19 @@ class MIDIFile(object):
         :param eventtime_is_ticks: If set True means event time and duration
             argument values are integer ticks instead of fractional quarter
             notes.
+        :param columnar: If set to ``True`` the notes of each track are kept
+            in parallel arrays (see :class:`NoteColumns`) rather than as a
+            pair of event objects each, which takes far less memory for files
+            with very many notes. The file written is the same.
+        :param running_status: If set to ``True`` the tracks are written with
+            running status: the status byte of a channel event is left out
+            when it is the same as that of the channel event before it. This
+            saves most for runs of the same kind of event on one channel,
+            such as chords or controller sweeps.
+        :param zero_velocity_note_off: If set to ``True`` note offs are
+            written as note ons with velocity zero, which MIDI treats the
+            same. With ``running_status`` the notes on a channel then share
+            one status byte.
 
         Note that the default for ``adjust_origin`` will change in a future
         release, so one should probably explicitly set it.
@@ -1041,16 +1498,29 @@ class MIDIFile(object):
         done to try and preserve as much interoperability with previous
         versions as possible.
 
+        A format 0 file has a single track. It is indexed just like a format 1
+        file -- the tempo track and each note track are kept apart -- but when
+        the file is written the tracks are merged into one. A single track
+        format 0 file is smaller than the equivalent format 1 file, and
+        players need not merge its tracks themselves.
+
         In a format 2 file all tracks are indexed and the track parameter
         is interpreted literally.
         '''
 
         self.tracks = list()
-        if file_format == 1:
+        if file_format != 2:
             self.numTracks = numTracks + 1  # self.tracks[0] is the baked-in tempo track
         else:
             self.numTracks = numTracks
-        self.header = MIDIHeader(self.numTracks, file_format, ticks_per_quarternote)
+        if file_format == 0:
+            # The tracks are merged into this one when the file is closed
+            self.mergedTrack = MIDITrack(removeDuplicates, deinterleave, columnar,
+                                         running_status, zero_velocity_note_off)
+            self.header = MIDIHeader(1, file_format, ticks_per_quarternote)
+        else:
+            self.mergedTrack = None
+            self.header = MIDIHeader(self.numTracks, file_format, ticks_per_quarternote)
 
         self.adjust_origin = adjust_origin
         self.closed = False
@@ -1063,7 +1533,8 @@ class MIDIFile(object):
             self.time_to_ticks = self.quarter_to_tick
 
         for i in range(0, self.numTracks):
-            self.tracks.append(MIDITrack(removeDuplicates, deinterleave))
+            self.tracks.append(MIDITrack(removeDuplicates, deinterleave, columnar,
+                                         running_status, zero_velocity_note_off))
         # to keep track of the order of insertion for new sorting
         self.event_counter = 0
 
@@ -1076,6 +1547,17 @@ class MIDIFile(object):
     def tick_to_quarter(self, ticknum):
         return float(ticknum) / self.ticks_per_quarternote
 
+    def quarters_to_ticks(self, quarternote_times):
+        '''
+        The same as ``quarter_to_tick()``, for a sequence of times. The
+        conversion is done in one pass with NumPy if it is installed.
+        '''
+        if numpy is not None:
+            ticks = numpy.asarray(quarternote_times, dtype=float) * self.ticks_per_quarternote
+            return ticks.astype(numpy.int64).tolist()
+        return [int(quarternote_time * self.ticks_per_quarternote)
+                for quarternote_time in quarternote_times]
+
     def addNote(self, track, channel, pitch, time, duration, volume,
                 annotation=None):
         """
@@ -1100,7 +1582,7 @@ class MIDIFile(object):
         `csound <http://csound.github.io/>`_ orchestra files directly from the
         class ``EventList``.
         """
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format != 2:
             track += 1
         self.tracks[track].addNoteByNumber(channel, pitch,
                                            self.time_to_ticks(time), self.time_to_ticks(duration),
@@ -1108,6 +1590,57 @@ class MIDIFile(object):
                                            insertion_order=self.event_counter)
         self.event_counter += 1
 
+    def addNotes(self, track, channel, pitches, times, durations, volumes):
+        """
+
+        Add many notes to the MIDIFile object at once
+
+        :param track: The track to which the notes are added.
+        :param channel: the MIDI channel of the notes. [Integer, 0-15]
+        :param pitches: the MIDI pitch numbers of the notes [Integer, 0-127].
+        :param times: the times at which the notes sound, in quarter notes
+            or ticks as for ``addNote()``.
+        :param durations: the durations of the notes.
+        :param volumes: the volumes (velocities) of the notes. [Integer, 0-127].
+
+        Apart from ``track``, each argument may be either a sequence (a list,
+        ``array``, ``bytes``, NumPy array and so on) holding a value for each
+        note, or a single value used for every note. The sequences must all
+        be the same length.
+
+        The result is the same as calling ``addNote()`` for each note in turn,
+        but times are converted to ticks all at once (using NumPy if it is
+        installed), and the notes are added to the track in bulk.
+
+        Example:
+
+        .. code::
+
+            # A scale of quarter notes, starting at beat 4
+            MyMIDI.addNotes(0, 0, [60, 62, 64, 65, 67], [4, 5, 6, 7, 8], 1, 100)
+        """
+        columns = [channel, pitches, times, durations, volumes]
+        lengths = set(len(column) for column in columns if hasattr(column, '__len__'))
+        if len(lengths) > 1:
+            raise ValueError("addNotes() sequences must all be the same length")
+        count = lengths.pop() if lengths else 1
+        columns = [column if hasattr(column, '__len__') else [column] * count
+                   for column in columns]
+
+        if not self.eventtime_is_ticks:
+            columns[2] = self.quarters_to_ticks(columns[2])
+            columns[3] = self.quarters_to_ticks(columns[3])
+        if numpy is not None:
+            columns = [column.tolist() if isinstance(column, numpy.ndarray) else column
+                       for column in columns]
+        (channels, pitches, ticks, durations, volumes) = columns
+
+        if self.header.numeric_format != 2:
+            track += 1
+        self.tracks[track].addNotesByNumber(channels, pitches, ticks, durations,
+                                            volumes, insertion_order=self.event_counter)
+        self.event_counter += count
+
     def addTrackName(self, track, time, trackName):
         """
         Name a track.
@@ -1118,7 +1651,7 @@ class MIDIFile(object):
             of the track).
         :param trackName: The name to assign to the track [String]
         """
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format != 2:
             track += 1
         self.tracks[track].addTrackName(self.time_to_ticks(time), trackName,
                                         insertion_order=self.event_counter)
@@ -1175,7 +1708,7 @@ class MIDIFile(object):
         time signature of, say, 6/8, one still needs to specify the clocks
         per quarter note.
         '''
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format != 2:
             track = 0
 
         self.tracks[track].addTimeSignature(self.time_to_ticks(time), numerator, denominator,
@@ -1194,7 +1727,7 @@ class MIDIFile(object):
         :param time: The time (in beats) at which tempo event is placed
         :param tempo: The tempo, in Beats per Minute. [Integer]
         """
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format != 2:
             track = 0
         self.tracks[track].addTempo(self.time_to_ticks(time), tempo,
                                     insertion_order=self.event_counter)
@@ -1210,7 +1743,7 @@ class MIDIFile(object):
             general this sould be time t=0
         :param notice: The copyright notice [String]
         """
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format != 2:
             track += 1
         self.tracks[track].addCopyright(self.time_to_ticks(time), notice,
                                         insertion_order=self.event_counter)
@@ -1248,7 +1781,7 @@ class MIDIFile(object):
 
             MyMIDI.addKeySignature(0, 0, 3, SHARPS, MINOR)
         '''
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format != 2:
             track = 0  # User reported that this is needed.
         self.tracks[track].addKeySignature(self.time_to_ticks(time), accidentals, accidental_type,
                                            mode, insertion_order=self.event_counter)
@@ -1263,7 +1796,7 @@ class MIDIFile(object):
         :param time: The time (in beats) at which text event is placed.
         :param text: The text to adde [ASCII String]
         """
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format != 2:
             track += 1
         self.tracks[track].addText(self.time_to_ticks(time), text,
                                    insertion_order=self.event_counter)
@@ -1281,7 +1814,7 @@ class MIDIFile(object):
             placed [Float].
         :param program: the program number. [Integer, 0-127].
         """
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format != 2:
             tracknum += 1
         self.tracks[tracknum].addProgramChange(channel, self.time_to_ticks(time), program,
                                                insertion_order=self.event_counter)
@@ -1298,7 +1831,7 @@ class MIDIFile(object):
             placed [Float].
         :param pressure_value: the pressure value. [Integer, 0-127].
         """
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format != 2:
             tracknum += 1
         track = self.tracks[tracknum]
         track.addChannelPressure(channel, self.time_to_ticks(time), pressure_value,
@@ -1319,7 +1852,7 @@ class MIDIFile(object):
         :param parameter: The event's parameter, the meaning of which varies by
             event type.
         """
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format != 2:
             track += 1
         self.tracks[track].addControllerEvent(channel, self.time_to_ticks(time), controller_number,
                                               parameter, insertion_order=self.event_counter)  # noqa: E128
@@ -1335,7 +1868,7 @@ class MIDIFile(object):
         :param time: The time (in beats) at which the event is placed [Float].
         :param pitchWheelValue: 0 for no pitch change. [Integer, -8192-8192]
         """
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format != 2:
             track += 1
         self.tracks[track].addPitchWheelEvent(channel, self.time_to_ticks(time), pitchWheelValue,
                                               insertion_order=self.event_counter)
@@ -1400,7 +1933,7 @@ class MIDIFile(object):
         '''
         tick = self.time_to_ticks(time)
 
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format != 2:
             track += 1
         track = self.tracks[track]
 
@@ -1455,7 +1988,7 @@ class MIDIFile(object):
         '''
         tick = self.time_to_ticks(time)
 
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format != 2:
             track += 1
         track = self.tracks[track]
 
@@ -1558,7 +2091,7 @@ class MIDIFile(object):
             tuning = [(69, 500)]
             MyMIDI.changeNoteTuning(0, tuning, tuningProgam=0)
         """
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format != 2:
             track += 1
         self.tracks[track].changeNoteTuning(tunings, sysExChannel, realTime,
                                             tuningProgam,
@@ -1583,7 +2116,7 @@ class MIDIFile(object):
 
         '''
         tick = self.time_to_ticks(time)
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format != 2:
             track += 1
         self.tracks[track].addSysEx(tick, manID, payload,
                                     insertion_order=self.event_counter)
@@ -1616,7 +2149,7 @@ class MIDIFile(object):
 
         '''
         tick = self.time_to_ticks(time)
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format != 2:
             track += 1
         self.tracks[track].addUniversalSysEx(tick, code, subcode, payload,
                                              sysExChannel, realTime,
@@ -1637,6 +2170,9 @@ class MIDIFile(object):
         self.close()
 
         # Write the MIDI Events to file.
+        if self.mergedTrack is not None:
+            self.mergedTrack.writeTrack(fileHandle)
+            return
         for i in range(0, self.numTracks):
             self.tracks[i].writeTrack(fileHandle)
 
@@ -1656,6 +2192,8 @@ class MIDIFile(object):
                 for event in track.eventList:
                     if event.tick < origin:
                         origin = event.tick
+            if track.notes is not None and len(track.notes) > 0:
+                origin = min(origin, min(track.notes.ticks))
 
         for track in self.tracks:
             tempEventList = []
@@ -1669,37 +2207,98 @@ class MIDIFile(object):
                 tempEventList.append(event)
 
             track.eventList = tempEventList
+            track.closed = False
+
+            if track.notes is not None:
+                ticks = track.notes.ticks
+                for i in range(len(ticks)):
+                    ticks[i] = ticks[i] - origin + tick_offset
 
     # End Public Functions ########################
 
     def close(self):
         '''
-        Close the MIDIFile for further writing.
+        Prepare the MIDIFile for writing.
 
         To close the File for events, we must close the tracks, adjust the time
         to be zero-origined, and have the tracks write to their MIDI Stream
         data structure.
+
+        The events are left as they were added, so more may be added after a
+        file is closed, and the file written again. Only tracks which have
+        changed (or whose origin has moved) are processed again.
+
+        In a format 0 file the tracks are then merged into one (see
+        ``mergeTracks()``).
         '''
 
-        if self.closed:
-            return
+        changed = any(track.hasChanged() for track in self.tracks)
 
+        # Closing a track sorts its MIDIEventList
         for i in range(0, self.numTracks):
             self.tracks[i].closeTrack()
-            # We want things like program changes to come before notes when
-            # they are at the same time, so we sort the MIDI events by both
-            # their start time and a secondary ordinality defined for each kind
-            # of event.
-            self.tracks[i].MIDIEventList.sort(key=sort_events)
 
         origin = self.findOrigin()
 
         for i in range(0, self.numTracks):
             self.tracks[i].adjustTimeAndOrigin(origin, self.adjust_origin)
-            self.tracks[i].writeMIDIStream()
+            if self.mergedTrack is None:
+                self.tracks[i].writeMIDIStream()
+
+        if self.mergedTrack is not None and (changed or not self.closed):
+            self.mergeTracks()
 
         self.closed = True
 
+    def mergeTracks(self):
+        '''
+        Write the closed tracks of a format 0 file into its single track.
+
+        Each track's events are already sorted, so rather than sorting them
+        all again they are merged, with a heap holding the next event from
+        each track. Events from different tracks are ordered just as they
+        would be within a track, on their tick, ``sec_sort_order`` and
+        ``insertion_order``.
+        '''
+        tracks = self.tracks
+        merged = self.mergedTrack
+        midibytes = bytearray()
+        running_status = merged.running_status
+        running = None
+
+        # The heap holds the key of each track's next event, and the
+        # iterator of the keys of the ones after it
+        heap = []
+        for (index, track) in enumerate(tracks):
+            keys = track.streamKeys(index)
+            for key in keys:
+                heap.append((key, keys))
+                break
+        heapq.heapify(heap)
+
+        previous_event_tick = tracks[0].origin
+        while len(heap) > 1:
+            ((tick, sec_sort_order, insertion_order, index, k), keys) = heap[0]
+            start = len(midibytes)
+            tracks[index].writeStreamItem(midibytes, k, previous_event_tick)
+            if running_status:
+                running = dropRunningStatus(midibytes, start, running)
+            previous_event_tick = tick
+            key = next(keys, None)
+            if key is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (key, keys))
+
+        # Once only one track has events left, it writes them itself
+        if heap:
+            ((tick, sec_sort_order, insertion_order, index, k), keys) = heap[0]
+            tracks[index].writeEventsToStream(midibytes, k, previous_event_tick, running)
+
+        midibytes.extend((0x00, 0xFF, 0x2F, 0x00))
+        merged.MIDIdata = bytes(midibytes)
+        merged.dataLength = struct.pack('>L', len(merged.MIDIdata))
+
     def findOrigin(self):
         '''
         Find the earliest time in the file's tracks.append.
@@ -1713,13 +2312,612 @@ class MIDIFile(object):
     #          assuming the list to be sorted.
 
         for track in self.tracks:
-            if len(track.MIDIEventList) > 0:
-                if track.MIDIEventList[0].tick < origin:
-                    origin = track.MIDIEventList[0].tick
+            tick = track.firstTick()
+            if tick is not None and tick < origin:
+                origin = tick
 
         return origin
 
 
+class MIDIFragment(object):
+    '''
+    A sequence of notes serialized ahead of time by
+    ``MIDIStreamWriter.makeFragment()``.
+
+    The delta time and status byte of the first event are not stored, but
+    worked out when the fragment is added to a stream: ``start`` is the tick
+    of the first event and ``status`` its status byte. ``data`` holds the
+    rest of the serialized events, ``length`` is the tick of the last one,
+    and ``running`` is the running status byte at the end (``None`` if
+    running status is not used).
+    '''
+
+    __slots__ = ('start', 'status', 'data', 'length', 'running')
+
+    def __init__(self, midibytes, length, running):
+        if midibytes:
+            (self.start, index) = readVarLength(0, midibytes)
+            self.status = midibytes[index]
+            self.data = bytes(midibytes[index + 1:])
+        else:
+            (self.start, self.status, self.data) = (0, None, b'')
+        self.length = length
+        self.running = running
+
+
+class MIDIStreamWriter(object):
+    '''
+    Write a MIDI file as its events are added.
+
+    A ``MIDIFile`` keeps every event until the file is written. When the
+    events are added in time order, a ``MIDIStreamWriter`` can serialize each
+    one to the file as it is added instead. Only the note off events still to
+    come are kept, in a heap, so the memory used does not grow with the length
+    of the file.
+
+    The file written is format 0: a header and a single track, which holds the
+    tempo and meta events as well as the notes. The length of the track is
+    written when the stream is closed, so the file handle must be seekable.
+
+    The methods which add events are those of ``MIDIFile``, other than
+    ``addNotes()``, and take the same arguments without the track.
+
+    Example:
+
+    .. code::
+
+        with open("output.mid", "wb") as output_file:
+            stream = MIDIStreamWriter(output_file)
+            stream.addTempo(0, 120)
+            stream.addNote(0, 60, 0, 1, 100)
+            stream.close()
+    '''
+
+    def __init__(self, fileHandle, deinterleave=True,
+                 ticks_per_quarternote=TICKSPERQUARTERNOTE, eventtime_is_ticks=False,
+                 running_status=False, zero_velocity_note_off=False, bufferSize=0x10000):
+        '''
+        Write the header, and start the track.
+
+        :param fileHandle: A seekable file handle that has been opened for
+            binary writing, or ``None`` to keep the serialized events in
+            ``midibytes`` (as ``makeFragment()`` does).
+        :param deinterleave: If set to ``True`` a note which is still sounding
+            when the same pitch starts again on its channel is ended there, as
+            ``MIDIFile`` does.
+        :param ticks_per_quarternote: As for ``MIDIFile``.
+        :param eventtime_is_ticks: As for ``MIDIFile``.
+        :param running_status: As for ``MIDIFile``.
+        :param zero_velocity_note_off: As for ``MIDIFile``.
+        :param bufferSize: The serialized events are written to the file in
+            blocks of about this many bytes.
+
+        Events must be added in time order: a ``ValueError`` is raised for an
+        event earlier than the one before it. Events at the same time are
+        written in the order they are added, after any note offs due then
+        (which are in the order their notes were added). ``MIDIFile`` sorts
+        the events at the same time by kind instead, so while the two write
+        the same events at the same times, those at the same time may come in
+        a different order. Duplicate events are not removed.
+        '''
+        if fileHandle is not None:
+            try:
+                seekable = getattr(fileHandle, 'seekable', None)
+                if seekable is not None and not seekable():
+                    raise ValueError
+                fileHandle.tell()
+            except (AttributeError, IOError, OSError, ValueError):
+                raise ValueError("MIDIStreamWriter needs a seekable file handle "
+                                 "opened for binary writing")
+        self.fileHandle = fileHandle
+        self.header = MIDIHeader(1, 0, ticks_per_quarternote)
+        self.dataLength = 0
+        if fileHandle is not None:
+            self.header.writeFile(fileHandle)
+            fileHandle.write(struct.pack('cccc', b'M', b'T', b'r', b'k'))
+            # The track length is written over this once it is known
+            self.lengthPosition = fileHandle.tell()
+            fileHandle.write(struct.pack('>L', 0))
+
+        self.midibytes = bytearray()
+        self.bufferSize = bufferSize
+        self.tick = 0  # The tick of the last event written
+        # The note off events to come, as (tick, order, channel, pitch, volume)
+        self.noteOffs = []
+        self.deinterleave = deinterleave
+        # The velocities of the notes sounding, and the number of note offs to
+        # skip, by channel << 7 | pitch
+        self.sounding = {}
+        self.endedEarly = {}
+        self.event_counter = 0
+        self.closed = False
+        self.running_status = running_status
+        self.zero_velocity_note_off = zero_velocity_note_off
+        self.running = None  # The running status byte, if there is one
+
+        self.ticks_per_quarternote = ticks_per_quarternote
+        if eventtime_is_ticks:
+            self.time_to_ticks = lambda x: x
+        else:
+            self.time_to_ticks = self.quarter_to_tick
+
+    def quarter_to_tick(self, quarternote_time):
+        return int(quarternote_time * self.ticks_per_quarternote)
+
+    def addNote(self, channel, pitch, time, duration, volume):
+        """
+        Add a note. The arguments are as for ``MIDIFile.addNote()``, without
+        the track.
+        """
+        tick = self.time_to_ticks(time)
+        self.writeNoteOffs(tick)
+        if self.deinterleave:
+            key = channel << 7 | pitch
+            if key in self.sounding:
+                # End the note which is sounding, and skip its note off
+                self.writeNoteOff(channel, tick, pitch, self.sounding[key])
+                self.endedEarly[key] = self.endedEarly.get(key, 0) + 1
+            self.sounding[key] = volume
+        self.writeChannelEvent(NoteOn.midi_status | channel, tick, pitch, volume)
+        heapq.heappush(self.noteOffs, (tick + self.time_to_ticks(duration), self.event_counter,
+                                       channel, pitch, volume))
+        self.event_counter += 1
+
+    def makeFragment(self, notes):
+        '''
+        Serialize a sequence of notes once, so that it can be added to the
+        stream any number of times with ``addFragment()``.
+
+        :param notes: The notes, as ``(channel, pitch, time, duration,
+            volume)`` tuples in time order. The times are relative to the
+            start of the fragment.
+
+        Returns a ``MIDIFragment``. The notes are serialized with this
+        stream's settings, and the fragment should only be added to it (or to
+        a stream with the same settings).
+        '''
+        writer = MIDIStreamWriter(None, self.deinterleave, self.ticks_per_quarternote,
+                                  eventtime_is_ticks=True, running_status=self.running_status,
+                                  zero_velocity_note_off=self.zero_velocity_note_off)
+        for (channel, pitch, time, duration, volume) in notes:
+            writer.addNote(channel, pitch, self.time_to_ticks(time),
+                           self.time_to_ticks(duration), volume)
+        if writer.noteOffs:
+            writer.writeNoteOffs(max(noteOff[0] for noteOff in writer.noteOffs))
+        return MIDIFragment(writer.midibytes, writer.tick, writer.running)
+
+    def addFragment(self, fragment, time):
+        '''
+        Add the notes of a fragment made by ``makeFragment()``, starting at
+        ``time``.
+
+        Only the delta time of the first event, and whether it needs its
+        status byte, depend on where the fragment goes, so the rest of its
+        bytes are copied to the stream as they are.
+
+        Notes already added may not end during the fragment - a
+        ``ValueError`` is raised if they do. Notes which carry on past the
+        end of the fragment are not deinterleaved from its notes.
+        '''
+        tick = self.time_to_ticks(time)
+        self.writeNoteOffs(tick)
+        if fragment.status is None:
+            return
+        end = tick + fragment.length
+        if self.noteOffs and self.noteOffs[0][0] < end:
+            raise ValueError("A note added before the MIDI fragment at tick %d "
+                             "ends during it" % tick)
+        self.midibytes += packVarLength(tick + fragment.start - self.tick)
+        if fragment.status != self.running:
+            self.midibytes.append(fragment.status)
+        self.midibytes += fragment.data
+        self.tick = end
+        if self.running_status:
+            self.running = fragment.running
+        if len(self.midibytes) >= self.bufferSize:
+            self.flush()
+
+    def addTrackName(self, time, trackName):
+        """
+        Name the track. See ``MIDIFile.addTrackName()``.
+        """
+        self.addEvent(TrackName(self.time_to_ticks(time), trackName))
+
+    def addTempo(self, time, tempo):
+        """
+        Add a tempo event. See ``MIDIFile.addTempo()``.
+        """
+        self.addEvent(Tempo(self.time_to_ticks(time), tempo))
+
+    def addCopyright(self, time, notice):
+        """
+        Add a copyright notice. See ``MIDIFile.addCopyright()``.
+        """
+        self.addEvent(Copyright(self.time_to_ticks(time), notice))
+
+    def addText(self, time, text):
+        """
+        Add a text event. See ``MIDIFile.addText()``.
+        """
+        self.addEvent(Text(self.time_to_ticks(time), text))
+
+    def addProgramChange(self, channel, time, program):
+        """
+        Add a program change event. See ``MIDIFile.addProgramChange()``.
+        """
+        self.addEvent(ProgramChange(channel, self.time_to_ticks(time), program))
+
+    def addTimeSignature(self, time, numerator, denominator, clocks_per_tick,
+                         notes_per_quarter=8):
+        """
+        Add a time signature event. See ``MIDIFile.addTimeSignature()``.
+        """
+        self.addEvent(TimeSignature(self.time_to_ticks(time), numerator, denominator,
+                                    clocks_per_tick, notes_per_quarter))
+
+    def addKeySignature(self, time, accidentals, accidental_type, mode):
+        """
+        Add a key signature event. See ``MIDIFile.addKeySignature()``.
+        """
+        self.addEvent(KeySignature(self.time_to_ticks(time), accidentals,
+                                   accidental_type, mode))
+
+    def addChannelPressure(self, channel, time, pressure_value):
+        """
+        Add a channel pressure event. See ``MIDIFile.addChannelPressure()``.
+        """
+        self.addEvent(ChannelPressureEvent(channel, self.time_to_ticks(time),
+                                           pressure_value))
+
+    def addControllerEvent(self, channel, time, controller_number, parameter):
+        """
+        Add a channel control event. See ``MIDIFile.addControllerEvent()``.
+        """
+        self.addEvent(ControllerEvent(channel, self.time_to_ticks(time),
+                                      controller_number, parameter))
+
+    def addPitchWheelEvent(self, channel, time, pitchWheelValue):
+        """
+        Add a pitch wheel event. See ``MIDIFile.addPitchWheelEvent()``.
+        """
+        self.addEvent(PitchWheelEvent(channel, self.time_to_ticks(time),
+                                      pitchWheelValue))
+
+    def makeRPNCall(self, channel, time, controller_msb, controller_lsb,
+                    data_msb, data_lsb, time_order=False):
+        """
+        Perform a Registered Parameter Number call. See
+        ``MIDIFile.makeRPNCall()``.
+        """
+        self.addParameterCall(channel, time, (101, 100), controller_msb,
+                              controller_lsb, data_msb, data_lsb, time_order)
+
+    def makeNRPNCall(self, channel, time, controller_msb, controller_lsb,
+                     data_msb, data_lsb, time_order=False):
+        """
+        Perform a Non-Registered Parameter Number call. See
+        ``MIDIFile.makeNRPNCall()``.
+        """
+        self.addParameterCall(channel, time, (99, 98), controller_msb,
+                              controller_lsb, data_msb, data_lsb, time_order)
+
+    def addParameterCall(self, channel, time, controllers, controller_msb,
+                         controller_lsb, data_msb, data_lsb, time_order):
+        # The controller events of an RPN or NRPN call, selecting the
+        # parameter with the pair of ``controllers`` and then setting it
+        tick = self.time_to_ticks(time)
+        tick_incr = 1 if time_order else 0
+        events = [(controllers[0], controller_msb), (controllers[1], controller_lsb),
+                  (6, data_msb)]
+        if data_lsb is not None:
+            events.append((38, data_lsb))
+        for (controller_number, parameter) in events:
+            self.addEvent(ControllerEvent(channel, tick, controller_number, parameter))
+            tick += tick_incr
+
+    def changeTuningBank(self, channel, time, bank, time_order=False):
+        """
+        Change the tuning bank. See ``MIDIFile.changeTuningBank()``.
+        """
+        self.makeRPNCall(channel, time, 0, 4, 0, bank, time_order=time_order)
+
+    def changeTuningProgram(self, channel, time, program, time_order=False):
+        """
+        Change the tuning program. See ``MIDIFile.changeTuningProgram()``.
+        """
+        self.makeRPNCall(channel, time, 0, 3, 0, program, time_order=time_order)
+
+    def changeNoteTuning(self, tunings, sysExChannel=0x7F, realTime=True,
+                         tuningProgam=0):
+        """
+        Add a real-time MIDI tuning standard update. See
+        ``MIDIFile.changeNoteTuning()``. As there, the update is placed at
+        time 0, so it must come before any event at a later time.
+        """
+        payload = bytearray((tuningProgam, len(tunings)))
+        for (noteNumber, frequency) in tunings:
+            payload.append(noteNumber)
+            payload.extend(frequencyTransform(frequency))
+        self.addEvent(UniversalSysExEvent(0, realTime, sysExChannel, 8, 2, bytes(payload)))
+
+    def addSysEx(self, time, manID, payload):
+        """
+        Add a System Exclusive event. See ``MIDIFile.addSysEx()``.
+        """
+        self.addEvent(SysExEvent(self.time_to_ticks(time), manID, payload))
+
+    def addUniversalSysEx(self, time, code, subcode, payload, sysExChannel=0x7F,
+                          realTime=False):
+        """
+        Add a Universal System Exclusive event. See
+        ``MIDIFile.addUniversalSysEx()``.
+        """
+        self.addEvent(UniversalSysExEvent(self.time_to_ticks(time), realTime, sysExChannel,
+                                          code, subcode, payload))
+
+    def addEvent(self, event):
+        '''
+        Write an event (other than a note) to the stream.
+        '''
+        self.writeNoteOffs(event.tick)
+        start = len(self.midibytes)
+        event.serialize_into(self.midibytes, self.tick)
+        if self.running_status:
+            self.running = dropRunningStatus(self.midibytes, start, self.running)
+        self.tick = event.tick
+        if len(self.midibytes) >= self.bufferSize:
+            self.flush()
+
+    def writeNoteOffs(self, tick):
+        '''
+        Write the note offs due at or before ``tick``, which is the time of
+        the next event.
+        '''
+        if self.closed:
+            raise ValueError("The MIDI stream has been closed")
+        if tick < self.tick:
+            raise ValueError("MIDI stream events must be added in time order "
+                             "(tick %d is before tick %d)" % (tick, self.tick))
+        noteOffs = self.noteOffs
+        while noteOffs and noteOffs[0][0] <= tick:
+            (offTick, order, channel, pitch, volume) = heapq.heappop(noteOffs)
+            if self.deinterleave:
+                key = channel << 7 | pitch
+                if self.endedEarly.get(key):
+                    self.endedEarly[key] -= 1
+                    continue
+                self.sounding.pop(key, None)
+            self.writeNoteOff(channel, offTick, pitch, volume)
+
+    def writeNoteOff(self, channel, tick, pitch, volume):
+        if self.zero_velocity_note_off:
+            self.writeChannelEvent(NoteOn.midi_status | channel, tick, pitch, 0)
+        else:
+            self.writeChannelEvent(NoteOff.midi_status | channel, tick, pitch, volume)
+
+    def writeChannelEvent(self, status, tick, data1, data2):
+        delta = tick - self.tick
+        self.tick = tick
+        if status == self.running:
+            if delta < 0x80:
+                self.midibytes += packChannel3(delta, data1, data2)
+            else:
+                self.midibytes += packVarLength(delta)
+                self.midibytes += packChannel2(data1, data2)
+        elif delta < 0x80:
+            self.midibytes += packNote(delta, status, data1, data2)
+        else:
+            self.midibytes += packVarLength(delta)
+            self.midibytes += packChannel3(status, data1, data2)
+        if self.running_status:
+            self.running = status
+        if len(self.midibytes) >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        '''
+        Write the events serialized so far to the file.
+        '''
+        if self.fileHandle is None:
+            return
+        self.fileHandle.write(self.midibytes)
+        self.dataLength += len(self.midibytes)
+        del self.midibytes[:]
+
+    def close(self):
+        '''
+        End the stream: write the remaining note offs and the end of the
+        track, then go back and fill in the length of the track. The file
+        handle is left at the end of the file, and is not closed. Without a
+        file handle the end of the track is left in ``midibytes``.
+        '''
+        if self.closed:
+            return
+        noteOffs = self.noteOffs
+        if noteOffs:
+            self.writeNoteOffs(max(noteOff[0] for noteOff in noteOffs))
+        self.midibytes.extend((0x00, 0xFF, 0x2F, 0x00))
+        self.flush()
+        self.closed = True
+
+        fileHandle = self.fileHandle
+        if fileHandle is None:
+            return
+        end = fileHandle.tell()
+        fileHandle.seek(self.lengthPosition)
+        fileHandle.write(struct.pack('>L', self.dataLength))
+        fileHandle.seek(end)
+
+
+# An event read from a file by MIDIFileReader. ``tick`` is absolute, and
+# ``status`` is the status byte, with running status filled in. For a meta
+# event (status 0xFF) ``meta_type`` is its type, otherwise it is None.
+# ``data`` is the bytes following the status byte (for a channel event) or
+# the length (for meta and SysEx events).
+TrackEvent = namedtuple('TrackEvent', ['tick', 'status', 'meta_type', 'data'])
+
+# The number of data bytes of each kind of channel event
+channelDataLengths = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+
+
+class MIDIFileReader(object):
+    '''
+    Read a Standard MIDI File.
+
+    The file is memory mapped rather than read. Opening it reads only the
+    header and the position of each track chunk, and a track's events are
+    decoded as they are iterated over, so even very large files are read
+    with little memory.
+
+    Example:
+
+    .. code::
+
+        with MIDIFileReader("output.mid") as reader:
+            for track in range(reader.numTracks):
+                for event in reader.events(track):
+                    if event.status & 0xF0 == 0x90 and event.data[1] > 0:
+                        print(event.tick, event.data[0])
+    '''
+
+    def __init__(self, fileName):
+        '''
+        Open the file and index its tracks.
+
+        :param fileName: The name of the file, or a file object opened for
+            binary reading (which is left open when the reader is closed).
+
+        Raises ``ValueError`` if the file is not a Standard MIDI File, or a
+        track chunk is cut short by the end of the file.
+        '''
+        if hasattr(fileName, 'fileno'):
+            self.fileHandle = None
+            fileno = fileName.fileno()
+        else:
+            self.fileHandle = open(fileName, 'rb')
+            fileno = self.fileHandle.fileno()
+        try:
+            self.data = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except ValueError:  # An empty file cannot be mapped
+            self.data = b''
+
+        data = self.data
+        if data[0:4] != b'MThd' or len(data) < 14:
+            self.close()
+            raise ValueError("Not a Standard MIDI File")
+        (headerSize, self.file_format, numTracks, self.ticks_per_quarternote) = \
+            struct.unpack_from('>LHHH', data, 4)
+
+        # The (offset, length) of the data of each track chunk. Chunks of
+        # other types are skipped.
+        self.trackOffsets = []
+        offset = 8 + headerSize
+        while offset + 8 <= len(data):
+            (chunkLength,) = struct.unpack_from('>L', data, offset + 4)
+            if data[offset:offset + 4] == b'MTrk':
+                if offset + 8 + chunkLength > len(data):
+                    message = ("The track chunk at offset %d is truncated: it has %d bytes "
+                               "of %d" % (offset, len(data) - offset - 8, chunkLength))
+                    self.close()
+                    raise ValueError(message)
+                self.trackOffsets.append((offset + 8, chunkLength))
+            offset += 8 + chunkLength
+        self.numTracks = len(self.trackOffsets)
+        if self.numTracks != numTracks:
+            warnings.warn("The MIDI file header gives %d tracks, but there are %d" %
+                          (numTracks, self.numTracks))
+
+    def events(self, track):
+        '''
+        Yield the events of a track, as :class:`TrackEvent` tuples, in the
+        order they are in the file.
+
+        :param track: The zero-based index of the track chunk.
+
+        Raises ``ValueError`` for an event which runs past the end of the
+        track chunk, or is otherwise malformed, giving its offset in the file.
+        '''
+        (start, length) = self.trackOffsets[track]
+        base = 0  # Added to an offset in data to give the offset in the file
+        data = self.data
+        if not isinstance(b'\x00'[0], int):
+            # Python 2 indexes a buffer as strings: decode a copy instead
+            data = bytearray(data[start:start + length])
+            (start, base) = (0, start)
+        end = start + length
+        offset = start
+        tick = 0
+        running = None
+
+        while offset < end:
+            eventStart = offset
+            try:
+                delta = 0
+                while True:
+                    byte = data[offset]
+                    offset += 1
+                    delta = delta << 7 | byte & 0x7F
+                    if byte < 0x80:
+                        break
+                tick += delta
+                if offset >= end:
+                    raise IndexError
+
+                status = data[offset]
+                if status < 0x80:
+                    # Running status: the data follows the delta time directly
+                    if running is None:
+                        raise ValueError("Data byte without a status at offset %d" % (offset + base))
+                    status = running
+                else:
+                    offset += 1
+
+                meta_type = None
+                if status < 0xF0:
+                    running = status
+                    dataLength = channelDataLengths[status & 0xF0]
+                else:
+                    # Meta and SysEx events cancel running status
+                    running = None
+                    if status == 0xFF:
+                        meta_type = data[offset]
+                        offset += 1
+                    elif status != 0xF0 and status != 0xF7:
+                        raise ValueError("Unexpected status 0x%02X at offset %d" %
+                                         (status, offset - 1 + base))
+                    dataLength = 0
+                    while True:
+                        byte = data[offset]
+                        offset += 1
+                        dataLength = dataLength << 7 | byte & 0x7F
+                        if byte < 0x80:
+                            break
+                if offset + dataLength > end:
+                    raise IndexError
+            except IndexError:
+                # Reading on past the end of the track, or of the file
+                raise ValueError("The event at offset %d runs past the end of the track" %
+                                 (eventStart + base))
+            yield TrackEvent(tick, status, meta_type, bytes(data[offset:offset + dataLength]))
+            offset += dataLength
+
+    def close(self):
+        '''
+        Unmap the file, and close it if the reader opened it.
+        '''
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        if self.fileHandle is not None:
+            self.fileHandle.close()
+            self.fileHandle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 def writeVarLength(i):
     '''
     Accept an integer, and serialize it as a MIDI file variable length quantity
@@ -1753,8 +2951,44 @@ def writeVarLength(i):
     return vlbytes
 
 
+# The encodings of every quantity that fits in one or two bytes, which covers
+# nearly all the delta times and lengths in a file.
+varLengthTable = [bytes(bytearray(writeVarLength(i))) for i in range(0x4000)]
+
+
+def packVarLength(i):
+    '''
+    Return the variable length quantity ``i`` as a bytestring. The same as
+    ``writeVarLength()``, but looked up in a table for small values.
+    '''
+    if 0 <= i < 0x4000:
+        return varLengthTable[i]
+    return bytes(bytearray(writeVarLength(i)))
+
+
 # readVarLength is taken from the MidiFile class.
 
+def dropRunningStatus(midibytes, start, running):
+    '''
+    Apply running status to the event serialized into ``midibytes`` from
+    ``start``, given the ``running`` status byte (or ``None``).
+
+    A channel event's status byte is deleted if it is the same as the running
+    status, and otherwise becomes the running status. Meta and SysEx events
+    cancel running status. Returns the running status after the event.
+    '''
+    pos = start
+    while midibytes[pos] & 0x80:  # Skip the delta time
+        pos += 1
+    pos += 1
+    status = midibytes[pos]
+    if status >= 0xF0:
+        return None
+    if status == running:
+        del midibytes[pos]
+    return status
+
+
 def readVarLength(offset, buffer):
     '''
     A function to read a MIDI variable length variable.
@@ -1807,6 +3041,114 @@ def returnFrequency(freqBytes):
     return frequency
 
 
+def uniqueIndices(keys):
+    '''
+    Return the indices of the first occurrence of each distinct key in
+    ``keys``, in order.
+    '''
+    seen = set()
+    indices = []
+    for (i, key) in enumerate(keys):
+        if key not in seen:
+            seen.add(key)
+            indices.append(i)
+    return indices
+
+
+# The result of usesIdentity() for each event class seen
+identityClasses = {}
+
+
+def usesIdentity(eventClass):
+    '''
+    Return ``True`` if the ``identity()`` of events of ``eventClass`` agrees
+    with their ``__eq__()``: that is, if ``identity()`` is defined in the same
+    class as ``__eq__()``, or a class derived from it. A class which
+    overrides ``__eq__()`` but inherits ``identity()``, such as a user's class
+    derived from ``NoteOn``, does not, and its events are compared with
+    ``__eq__()``.
+    '''
+    uses = identityClasses.get(eventClass)
+    if uses is None:
+        for base in eventClass.__mro__:
+            if 'identity' in vars(base) or '__eq__' in vars(base):
+                uses = 'identity' in vars(base)
+                break
+        identityClasses[eventClass] = uses = bool(uses)
+    return uses
+
+
+def sortEvents(events):
+    '''
+    Return a list of ``events`` in the order ``sorted(events, key=sort_events)``
+    would give.
+
+    Events are normally listed in insertion order, and then a stable sort on
+    just their tick and ``sec_sort_order`` gives the same result. Those are
+    packed into an integer key, ``tick << 2 | sec_sort_order``, which sorts
+    much faster than a tuple. Events which are already in order, as they are
+    when added in chronological order, are not sorted at all.
+
+    The built in events have a ``sec_sort_order`` from 0 to 3. If any event
+    has some other ``sec_sort_order``, which a derived class may, it does
+    not fit in the packed key, and the events are sorted on the tuple.
+    '''
+    orders = list(map(getInsertionOrder, events))
+    if not all(map(operator.le, orders, islice(orders, 1, None))):
+        return sorted(events, key=sortKey)
+
+    secSortOrders = list(map(getSecSortOrder, events))
+    if not (set(map(type, secSortOrders)) <= packedSortOrderTypes and
+            set(secSortOrders) <= packedSortOrders):
+        return sorted(events, key=sortKey)
+    keys = [tick << 2 | secSortOrder for (tick, secSortOrder) in zip(map(getTick, events), secSortOrders)]
+    if all(map(operator.le, keys, islice(keys, 1, None))):
+        return list(events)
+    return list(map(events.__getitem__, sorted(range(len(keys)), key=keys.__getitem__)))
+
+
+def removeIndices(items, indices):
+    '''
+    Return a list of ``items`` without those at ``indices``, which are in
+    ascending order.
+    '''
+    kept = []
+    start = 0
+    for index in indices:
+        kept.extend(items[start:index])
+        start = index + 1
+    kept.extend(items[start:])
+    return kept
+
+
+def mergeSorted(items, keys, others, otherKeys):
+    '''
+    Merge two sorted lists, ``items`` and ``others``, given the sort keys of
+    each. Where keys are equal, the item comes first.
+
+    The ``others`` are expected to be few: each is placed by a binary search
+    of ``keys``, and ``items`` are copied across in slices between them.
+    '''
+    merged = []
+    start = 0
+    for (other, key) in zip(others, otherKeys):
+        end = bisect.bisect_right(keys, key, start)
+        merged.extend(items[start:end])
+        merged.append(other)
+        start = end
+    merged.extend(items[start:])
+    return merged
+
+
+sortKey = operator.attrgetter('tick', 'sec_sort_order', 'insertion_order')
+getTick = operator.attrgetter('tick')
+getSecSortOrder = operator.attrgetter('sec_sort_order')
+getInsertionOrder = operator.attrgetter('insertion_order')
+# The sort orders sortEvents() can pack into two bits of its integer keys
+packedSortOrders = frozenset((0, 1, 2, 3))
+packedSortOrderTypes = frozenset((int,))
+
+
 def sort_events(event):
     '''
     .. py:function:: sort_events(event)
@@ -1,3 +1,3 @@
 from midiutil.MidiFile import *
 
-__all__ = ['MIDIFile', 'MAJOR', 'MINOR', 'SHARPS', 'FLATS']
+__all__ = ['MIDIFile', 'MIDIStreamWriter', 'MIDIFileReader', 'MAJOR', 'MINOR', 'SHARPS', 'FLATS']
@@ -18,9 +18,11 @@ import struct
 
 import unittest
 
+import midiutil.MidiFile
 from midiutil.MidiFile import *
 
-from midiutil.MidiFile import writeVarLength,  \
+from midiutil.MidiFile import writeVarLength, packVarLength, sortEvents, sort_events, \
+    GenericEvent, NoteOn, ControllerEvent, Text, \
     frequencyTransform, returnFrequency, MAJOR, MINOR, SHARPS, FLATS, MIDIFile
 
 
@@ -42,6 +44,33 @@ class Decoder(object):
         return struct.unpack('>B', self[key])[0]
 
 
+def deltaTicks(track):
+    '''
+    The delta times a closed track's MIDIEventList is written with.
+    '''
+    ticks = [track.origin] + [event.tick for event in track.MIDIEventList]
+    return [tick - previous for (previous, tick) in zip(ticks, ticks[1:])]
+
+
+def trackEvents(data, track=0):
+    '''
+    The events of a track of the MIDI file ``data``, sorted, so that tracks
+    holding the same events at the same times compare equal whatever the
+    order of the events at each time.
+    '''
+    import os
+    import tempfile
+    (handle, path) = tempfile.mkstemp(suffix='.mid')
+    try:
+        os.write(handle, data)
+        os.close(handle)
+        with MIDIFileReader(path) as reader:
+            return sorted((event.tick, event.status, event.meta_type, bytes(event.data))
+                          for event in reader.events(track))
+    finally:
+        os.remove(path)
+
+
 class TestMIDIUtils(unittest.TestCase):
 
     def testWriteVarLength(self):
@@ -50,6 +79,10 @@ class TestMIDIUtils(unittest.TestCase):
         self.assertEqual(writeVarLength(0x1FFFFF), [0xFF, 0xFF, 0x7F])
         self.assertEqual(writeVarLength(0x08000000), [0xC0, 0x80, 0x80, 0x00])
 
+    def testPackVarLength(self):
+        for i in (0, 0x70, 0x80, 0x3FFF, 0x4000, 0x1FFFFF, 0x08000000):
+            self.assertEqual(packVarLength(i), bytes(bytearray(writeVarLength(i))))
+
     def testAddNote(self):
         MyMIDI = MIDIFile(1)  # a format 1 file, so we increment the track number below
         track = 0
@@ -65,6 +98,15 @@ class TestMIDIUtils(unittest.TestCase):
         self.assertEqual(MyMIDI.tracks[1].eventList[0].duration, MyMIDI.time_to_ticks(duration))
         self.assertEqual(MyMIDI.tracks[1].eventList[0].volume, volume)
 
+    def testSlottedEvents(self):
+        MyMIDI = MIDIFile(1)
+        MyMIDI.addNote(0, 0, 100, 0, 1, 100, annotation='note')
+        MyMIDI.addTempo(0, 0, 120)
+        for track in MyMIDI.tracks:
+            for event in track.eventList:
+                self.assertFalse(hasattr(event, '__dict__'), event.evtname)
+        self.assertEqual(MyMIDI.tracks[1].eventList[0].annotation, 'note')
+
     def testShiftTrack(self):
         track = 0
         channel = 0
@@ -95,15 +137,38 @@ class TestMIDIUtils(unittest.TestCase):
         MyMIDI.addNote(track, channel, pitch, time2, duration, volume + 1)  # on at 1 off at 3
         MyMIDI.close()
 
-        # ticks have already been converted to delta ticks
+        # the events are written with delta ticks
         self.assertEqual(MyMIDI.tracks[1].MIDIEventList[0].evtname, 'NoteOn')
-        self.assertEqual(MyMIDI.tracks[1].MIDIEventList[0].tick, MyMIDI.time_to_ticks(time1))
+        self.assertEqual(deltaTicks(MyMIDI.tracks[1])[0], MyMIDI.time_to_ticks(time1))
         self.assertEqual(MyMIDI.tracks[1].MIDIEventList[1].evtname, 'NoteOff')
-        self.assertEqual(MyMIDI.tracks[1].MIDIEventList[1].tick, MyMIDI.time_to_ticks(time2))
+        self.assertEqual(deltaTicks(MyMIDI.tracks[1])[1], MyMIDI.time_to_ticks(time2))
         self.assertEqual(MyMIDI.tracks[1].MIDIEventList[2].evtname, 'NoteOn')
-        self.assertEqual(MyMIDI.tracks[1].MIDIEventList[2].tick, MyMIDI.time_to_ticks(time2 - time2))
+        self.assertEqual(deltaTicks(MyMIDI.tracks[1])[2], MyMIDI.time_to_ticks(time2 - time2))
         self.assertEqual(MyMIDI.tracks[1].MIDIEventList[3].evtname, 'NoteOff')
-        self.assertEqual(MyMIDI.tracks[1].MIDIEventList[3].tick, MyMIDI.time_to_ticks(time2 - time2 + duration))
+        self.assertEqual(deltaTicks(MyMIDI.tracks[1])[3], MyMIDI.time_to_ticks(time2 - time2 + duration))
+
+    def testDeinterleaveKeys(self):
+        # Pitch 101 on channel 5 and pitch 10 on channel 15 are different
+        # notes, and must not be deinterleaved against each other
+        MyMIDI = MIDIFile(1, adjust_origin=False)
+        MyMIDI.addNote(0, 5, 101, 0, 2, 100)
+        MyMIDI.addNote(0, 15, 10, 1, 2, 100)
+        MyMIDI.close()
+        events = list(zip([event.evtname for event in MyMIDI.tracks[1].MIDIEventList],
+                          deltaTicks(MyMIDI.tracks[1])))
+        self.assertEqual(events, [('NoteOn', 0), ('NoteOn', MyMIDI.time_to_ticks(1)),
+                                  ('NoteOff', MyMIDI.time_to_ticks(1)), ('NoteOff', MyMIDI.time_to_ticks(1))])
+
+        # A NoteOff left without a NoteOn, once a duplicate NoteOn has been
+        # removed, is written where it is
+        MyMIDI = MIDIFile(1, adjust_origin=False)
+        MyMIDI.addNote(0, 0, 60, 0, 1, 100)
+        MyMIDI.addNote(0, 0, 60, 0, 2, 100)
+        MyMIDI.close()
+        events = list(zip([event.evtname for event in MyMIDI.tracks[1].MIDIEventList],
+                          deltaTicks(MyMIDI.tracks[1])))
+        self.assertEqual(events, [('NoteOn', 0), ('NoteOff', MyMIDI.time_to_ticks(1)),
+                                  ('NoteOff', MyMIDI.time_to_ticks(1))])
 
     def testTimeShift(self):
 
@@ -118,9 +183,9 @@ class TestMIDIUtils(unittest.TestCase):
         MyMIDI.addNote(track, channel, pitch, time1, duration, volume)
         MyMIDI.close()
         self.assertEqual(MyMIDI.tracks[1].MIDIEventList[0].evtname, 'NoteOn')
-        self.assertEqual(MyMIDI.tracks[1].MIDIEventList[0].tick, MyMIDI.time_to_ticks(0))
+        self.assertEqual(deltaTicks(MyMIDI.tracks[1])[0], MyMIDI.time_to_ticks(0))
         self.assertEqual(MyMIDI.tracks[1].MIDIEventList[1].evtname, 'NoteOff')
-        self.assertEqual(MyMIDI.tracks[1].MIDIEventList[1].tick, MyMIDI.time_to_ticks(duration))
+        self.assertEqual(deltaTicks(MyMIDI.tracks[1])[1], MyMIDI.time_to_ticks(duration))
 
         # With two tracks
         track2 = 1
@@ -129,15 +194,15 @@ class TestMIDIUtils(unittest.TestCase):
         time2 = 6
         MyMIDI.addNote(track2, channel, pitch, time2, duration, volume)
         MyMIDI.close()
-        # ticks have already been converted to delta ticks
+        # the events are written with delta ticks
         self.assertEqual(MyMIDI.tracks[1].MIDIEventList[0].evtname, 'NoteOn')
-        self.assertEqual(MyMIDI.tracks[1].MIDIEventList[0].tick, MyMIDI.time_to_ticks(0))
+        self.assertEqual(deltaTicks(MyMIDI.tracks[1])[0], MyMIDI.time_to_ticks(0))
         self.assertEqual(MyMIDI.tracks[1].MIDIEventList[1].evtname, 'NoteOff')
-        self.assertEqual(MyMIDI.tracks[1].MIDIEventList[1].tick, MyMIDI.time_to_ticks(duration))
+        self.assertEqual(deltaTicks(MyMIDI.tracks[1])[1], MyMIDI.time_to_ticks(duration))
         self.assertEqual(MyMIDI.tracks[2].MIDIEventList[0].evtname, 'NoteOn')
-        self.assertEqual(MyMIDI.tracks[2].MIDIEventList[0].tick, MyMIDI.time_to_ticks(0 + duration))
+        self.assertEqual(deltaTicks(MyMIDI.tracks[2])[0], MyMIDI.time_to_ticks(0 + duration))
         self.assertEqual(MyMIDI.tracks[2].MIDIEventList[1].evtname, 'NoteOff')
-        self.assertEqual(MyMIDI.tracks[2].MIDIEventList[1].tick, MyMIDI.time_to_ticks(0 + duration))
+        self.assertEqual(deltaTicks(MyMIDI.tracks[2])[1], MyMIDI.time_to_ticks(0 + duration))
 
         # Negative Time
         MyMIDI = MIDIFile(1, adjust_origin=True)
@@ -150,9 +215,9 @@ class TestMIDIUtils(unittest.TestCase):
         MyMIDI.addNote(track, channel, pitch, time, duration, volume)
         MyMIDI.close()
         self.assertEqual(MyMIDI.tracks[1].MIDIEventList[0].evtname, 'NoteOn')
-        self.assertEqual(MyMIDI.tracks[1].MIDIEventList[0].tick, MyMIDI.time_to_ticks(0))
+        self.assertEqual(deltaTicks(MyMIDI.tracks[1])[0], MyMIDI.time_to_ticks(0))
         self.assertEqual(MyMIDI.tracks[1].MIDIEventList[1].evtname, 'NoteOff')
-        self.assertEqual(MyMIDI.tracks[1].MIDIEventList[1].tick, MyMIDI.time_to_ticks(0 + duration))
+        self.assertEqual(deltaTicks(MyMIDI.tracks[1])[1], MyMIDI.time_to_ticks(0 + duration))
 
         # Negative time, two tracks
 
@@ -169,13 +234,13 @@ class TestMIDIUtils(unittest.TestCase):
         MyMIDI.addNote(track2, channel, pitch, time2, duration, volume)
         MyMIDI.close()
         self.assertEqual(MyMIDI.tracks[1].MIDIEventList[0].evtname, 'NoteOn')
-        self.assertEqual(MyMIDI.tracks[1].MIDIEventList[0].tick, MyMIDI.time_to_ticks(0))
+        self.assertEqual(deltaTicks(MyMIDI.tracks[1])[0], MyMIDI.time_to_ticks(0))
         self.assertEqual(MyMIDI.tracks[1].MIDIEventList[1].evtname, 'NoteOff')
-        self.assertEqual(MyMIDI.tracks[1].MIDIEventList[1].tick, MyMIDI.time_to_ticks(1))
+        self.assertEqual(deltaTicks(MyMIDI.tracks[1])[1], MyMIDI.time_to_ticks(1))
         self.assertEqual(MyMIDI.tracks[2].MIDIEventList[0].evtname, 'NoteOn')
-        self.assertEqual(MyMIDI.tracks[2].MIDIEventList[0].tick, MyMIDI.time_to_ticks(1))
+        self.assertEqual(deltaTicks(MyMIDI.tracks[2])[0], MyMIDI.time_to_ticks(1))
         self.assertEqual(MyMIDI.tracks[2].MIDIEventList[1].evtname, 'NoteOff')
-        self.assertEqual(MyMIDI.tracks[2].MIDIEventList[1].tick, MyMIDI.time_to_ticks(1))
+        self.assertEqual(deltaTicks(MyMIDI.tracks[2])[1], MyMIDI.time_to_ticks(1))
 
     def testFrequency(self):
         freq = frequencyTransform(8.1758)
@@ -329,6 +394,38 @@ class TestMIDIUtils(unittest.TestCase):
         self.assertEqual(data.unpack_into_byte(3), 0x03)
         self.assertEqual(data[4:7], struct.pack('>L', int(60000000 / tempo))[1:4])
 
+    def testSerializeOnlyEvent(self):
+        from io import BytesIO
+
+        # A derived event written as documentation/extending.rst describes,
+        # defining serialize() but not serialize_into()
+        class OldTempo(GenericEvent):
+            evtname = 'Tempo'
+            sec_sort_order = 3
+
+            def __init__(self, tick, tempo, insertion_order=0):
+                self.tempo = int(60000000 / tempo)
+                super(OldTempo, self).__init__(tick, insertion_order)
+
+            def serialize(self, previous_event_tick):
+                midibytes = bytes(bytearray(writeVarLength(self.tick - previous_event_tick)))
+                return midibytes + b'\xff\x51\x03' + struct.pack('>L', self.tempo)[1:4]
+
+        written = []
+        for custom in (False, True):
+            MyMIDI = MIDIFile(1, file_format=2)
+            if custom:
+                MyMIDI.tracks[0].addEvent(OldTempo(960, 60))
+            else:
+                MyMIDI.addTempo(0, 1, 60)
+            output = BytesIO()
+            MyMIDI.writeFile(output)
+            written.append(output.getvalue())
+        self.assertEqual(written[0], written[1])
+
+        with self.assertRaises(NotImplementedError):
+            GenericEvent(0, 0).serialize(0)
+
     def testCopyright(self):
         notice = "2016(C) MCW"
         MyMIDI = MIDIFile(1)
@@ -523,6 +620,34 @@ class TestMIDIUtils(unittest.TestCase):
         self.assertEqual(data.unpack_into_byte(1), 0xFF)  # Code
         self.assertEqual(data.unpack_into_byte(2), 0x03)  # subcodes
 
+    def testLongCopyright(self):
+        notice = 'long copyright notice ' * 8
+        MyMIDI = MIDIFile(1)
+        MyMIDI.addCopyright(0, 0, notice)
+        MyMIDI.close()
+
+        data = Decoder(MyMIDI.tracks[1].MIDIdata)
+
+        self.assertEqual(data.unpack_into_byte(0), 0x00)  # time
+        self.assertEqual(data.unpack_into_byte(1), 0xFF)  # Code
+        self.assertEqual(data.unpack_into_byte(2), 0x02)  # Subcode
+        self.assertEqual(data[3:5], bytes(bytearray(writeVarLength(len(notice)))))
+        self.assertEqual(data[5:5 + len(notice)], notice.encode("ISO-8859-1"))
+
+    def testProgramChangeDelta(self):
+        MyMIDI = MIDIFile(1)
+        MyMIDI.addProgramChange(0, 0, 0, 10)
+        MyMIDI.addProgramChange(0, 0, 1, 11)
+        MyMIDI.close()
+
+        data = Decoder(MyMIDI.tracks[1].MIDIdata)
+
+        self.assertEqual(data.unpack_into_byte(0), 0x00)  # time
+        self.assertEqual(data.unpack_into_byte(2), 10)
+        self.assertEqual(data[3:5], bytes(bytearray(writeVarLength(MyMIDI.time_to_ticks(1)))))  # time
+        self.assertEqual(data.unpack_into_byte(5), 0xC0)  # Code
+        self.assertEqual(data.unpack_into_byte(6), 11)
+
     def testTuningBank(self):
         bank = 1
         channel = 0
@@ -833,6 +958,327 @@ class TestMIDIUtils(unittest.TestCase):
         data_length_3 = len(MyMIDI.tracks[0].MIDIdata)
         self.assertEqual(data_length_1, data_length_3)
 
+    def testRepeatWrite(self):
+        from io import BytesIO
+
+        def written(midi):
+            output = BytesIO()
+            midi.writeFile(output)
+            return output.getvalue()
+
+        for columnar in (False, True):
+            MyMIDI = MIDIFile(2, adjust_origin=True, columnar=columnar)
+            MyMIDI.addTempo(0, 1, 120)
+            MyMIDI.addNote(0, 0, 60, 1, 2, 100)
+            MyMIDI.addNote(0, 0, 60, 2, 2, 100)
+            MyMIDI.addNote(1, 0, 64, 1, 1, 100)
+            ticks = [event.tick for track in MyMIDI.tracks for event in track.eventList]
+            first = written(MyMIDI)
+            # Writing again gives the same file, and leaves the events alone
+            self.assertEqual(written(MyMIDI), first)
+            self.assertEqual([event.tick for track in MyMIDI.tracks for event in track.eventList], ticks)
+
+            # Only the track which changed is serialized again
+            data = [track.MIDIdata for track in MyMIDI.tracks]
+            MyMIDI.addNote(1, 0, 67, 3, 1, 100)
+            second = written(MyMIDI)
+            self.assertNotEqual(second, first)
+            self.assertIs(MyMIDI.tracks[0].MIDIdata, data[0])
+            self.assertIs(MyMIDI.tracks[1].MIDIdata, data[1])
+            self.assertIsNot(MyMIDI.tracks[2].MIDIdata, data[2])
+
+            # It is the file that would have been written had the note been
+            # there from the start
+            Fresh = MIDIFile(2, adjust_origin=True, columnar=columnar)
+            Fresh.addTempo(0, 1, 120)
+            Fresh.addNote(0, 0, 60, 1, 2, 100)
+            Fresh.addNote(0, 0, 60, 2, 2, 100)
+            Fresh.addNote(1, 0, 64, 1, 1, 100)
+            Fresh.addNote(1, 0, 67, 3, 1, 100)
+            self.assertEqual(second, written(Fresh))
+
+            # Moving the origin rewrites every track
+            data = [track.MIDIdata for track in MyMIDI.tracks]
+            MyMIDI.addNote(0, 0, 48, 0, 1, 100)
+            written(MyMIDI)
+            self.assertIsNot(MyMIDI.tracks[2].MIDIdata, data[2])
+
+            # An event appended to the eventList directly, rather than with
+            # addEvent(), is written too
+            before = written(MyMIDI)
+            MyMIDI.tracks[1].eventList.append(Text(MyMIDI.tracks[1].origin + 960, 'late'))
+            after = written(MyMIDI)
+            self.assertNotEqual(after, before)
+            self.assertIn(b'\xff\x01\x04late', after)
+
+    def testStreamWriter(self):
+        from io import BytesIO
+
+        def addEvents(add, addNote, addText):
+            add(0, 120)
+            addNote(0, 60, 0, 2, 100)
+            addNote(0, 60, 1, 2, 90)   # ends the first note at 1
+            addNote(1, 64, 1, 0.5, 80)
+            addNote(0, 62, 200, 1, 100)
+            addText(300, 'end')
+
+        output = BytesIO()
+        stream = MIDIStreamWriter(output, bufferSize=4)
+        addEvents(stream.addTempo, stream.addNote, stream.addText)
+        with self.assertRaises(ValueError):
+            stream.addNote(0, 60, 299, 1, 100)
+        stream.close()
+        data = output.getvalue()
+
+        # For these events, with none of different kinds at the same time, the
+        # track is the one a single track MIDIFile would write
+        MyMIDI = MIDIFile(1, file_format=2)
+        addEvents(lambda time, tempo: MyMIDI.addTempo(0, time, tempo),
+                  lambda *note: MyMIDI.addNote(0, *note),
+                  lambda time, text: MyMIDI.addText(0, time, text))
+        MyMIDI.close()
+        track = MyMIDI.tracks[0]
+        self.assertEqual(data[:14], b'MThd' + struct.pack('>LHHH', 6, 0, 1, 960))
+        self.assertEqual(data[14:], track.headerString + track.dataLength + track.MIDIdata)
+
+        with self.assertRaises(ValueError):
+            stream.addTempo(400, 100)
+
+        # The file handle must be seekable
+        with self.assertRaises(ValueError):
+            MIDIStreamWriter(object())
+        stream = MIDIStreamWriter(None)
+        stream.addNote(0, 60, 0, 1, 100)
+        stream.close()
+        self.assertEqual(stream.midibytes[-4:], b'\x00\xff\x2f\x00')
+
+    def testStreamWriterEvents(self):
+        from io import BytesIO
+
+        # In general the stream holds the same events as the MIDIFile, but
+        # those at the same time may be in a different order
+        def addEvents(add):
+            add('changeNoteTuning', [(69, 500)])
+            add('addTempo', 0, 120)
+            add('addTimeSignature', 0, 6, 3, 24)
+            add('addKeySignature', 0, 3, SHARPS, MINOR)
+            add('addNote', 0, 60, 0, 1, 100)
+            add('addNote', 0, 64, 0, 1, 100)
+            add('addText', 1, 'at the same time as the note offs')
+            add('addControllerEvent', 0, 1, 7, 100)
+            add('addProgramChange', 1, 1, 5)
+            add('addChannelPressure', 1, 1, 50)
+            add('addPitchWheelEvent', 1, 2, -100)
+            add('makeRPNCall', 0, 2, 0, 1, 64, None)
+            add('makeNRPNCall', 0, 3, 1, 2, 3, 4, time_order=True)
+            add('changeTuningBank', 0, 4, 1)
+            add('changeTuningProgram', 0, 4, 2)
+            add('addSysEx', 5, 0x41, b'\x01\x02')
+            add('addUniversalSysEx', 5, 0x08, 0x02, b'\x00\x00')
+
+        output = BytesIO()
+        stream = MIDIStreamWriter(output)
+        addEvents(lambda method, *args, **kwargs: getattr(stream, method)(*args, **kwargs))
+        stream.close()
+
+        MyMIDI = MIDIFile(1, file_format=2)
+        addEvents(lambda method, *args, **kwargs: getattr(MyMIDI, method)(0, *args, **kwargs))
+        written = BytesIO()
+        MyMIDI.writeFile(written)
+
+        self.assertEqual(trackEvents(output.getvalue()), trackEvents(written.getvalue()))
+        self.assertNotEqual(output.getvalue()[14:], written.getvalue()[14:])
+
+    def testRunningStatus(self):
+        from io import BytesIO
+
+        expected = bytes(bytearray([0x00, 0x90, 0x3C, 0x64,   # note on
+                                    0x00, 0x40, 0x64,         # note on, running status
+                                    0x87, 0x40, 0xFF, 0x01, 0x01, 0x78,  # text cancels running status
+                                    0x00, 0x80, 0x3C, 0x64,   # note off
+                                    0x00, 0x40, 0x64,         # note off, running status
+                                    0x87, 0x40, 0xB0, 0x07, 0x10,
+                                    0x00, 0xFF, 0x2F, 0x00]))
+        for columnar in (False, True):
+            MyMIDI = MIDIFile(1, file_format=2, columnar=columnar, running_status=True)
+            MyMIDI.addNote(0, 0, 60, 0, 1, 100)
+            MyMIDI.addNote(0, 0, 64, 0, 1, 100)
+            MyMIDI.addText(0, 1, 'x')
+            MyMIDI.addControllerEvent(0, 0, 2, 7, 16)
+            MyMIDI.close()
+            self.assertEqual(MyMIDI.tracks[0].MIDIdata, expected)
+
+        output = BytesIO()
+        stream = MIDIStreamWriter(output, running_status=True)
+        stream.addNote(0, 60, 0, 1, 100)
+        stream.addNote(0, 64, 0, 1, 100)
+        stream.addText(1, 'x')
+        stream.addControllerEvent(0, 2, 7, 16)
+        stream.close()
+        # The stream writes the note offs due before the text
+        self.assertEqual(output.getvalue()[22:],
+                         bytes(bytearray([0x00, 0x90, 0x3C, 0x64, 0x00, 0x40, 0x64,
+                                          0x87, 0x40, 0x80, 0x3C, 0x64, 0x00, 0x40, 0x64,
+                                          0x00, 0xFF, 0x01, 0x01, 0x78,
+                                          0x87, 0x40, 0xB0, 0x07, 0x10,
+                                          0x00, 0xFF, 0x2F, 0x00])))
+
+    def testZeroVelocityNoteOff(self):
+        from io import BytesIO
+
+        expected = bytes(bytearray([0x00, 0x90, 0x3C, 0x64,
+                                    0x87, 0x40, 0x3C, 0x00,  # note off, as a note on
+                                    0x00, 0x3E, 0x64,
+                                    0x87, 0x40, 0x3E, 0x00,
+                                    0x00, 0xFF, 0x2F, 0x00]))
+        for columnar in (False, True):
+            MyMIDI = MIDIFile(1, file_format=2, columnar=columnar, running_status=True,
+                              zero_velocity_note_off=True)
+            MyMIDI.addNote(0, 0, 60, 0, 1, 100)
+            MyMIDI.addNote(0, 0, 62, 1, 1, 100)
+            MyMIDI.close()
+            self.assertEqual(MyMIDI.tracks[0].MIDIdata, expected)
+
+            # Without running status each note off has a note on status byte
+            MyMIDI = MIDIFile(1, file_format=2, columnar=columnar, zero_velocity_note_off=True)
+            MyMIDI.addNote(0, 0, 60, 0, 1, 100)
+            MyMIDI.close()
+            self.assertEqual(MyMIDI.tracks[0].MIDIdata[4:9], b'\x87\x40\x90\x3C\x00')
+
+        output = BytesIO()
+        stream = MIDIStreamWriter(output, running_status=True, zero_velocity_note_off=True)
+        stream.addNote(0, 60, 0, 1, 100)
+        stream.addNote(0, 62, 1, 1, 100)
+        stream.close()
+        self.assertEqual(output.getvalue()[22:], expected)
+
+    def testStreamFragments(self):
+        from io import BytesIO
+
+        words = [[60, 62, 3], [64, 3], [60, 62, 3], [], [64, 3]]
+        for running_status in (False, True):
+            outputs = []
+            for fragments in (False, True):
+                output = BytesIO()
+                stream = MIDIStreamWriter(output, running_status=running_status,
+                                          zero_velocity_note_off=running_status)
+                stream.addTempo(0, 120)
+                time = 0
+                for word in words:
+                    notes = [(0, pitch, i * 0.5, 0.5, 100) for (i, pitch) in enumerate(word)]
+                    if fragments:
+                        stream.addFragment(stream.makeFragment(notes), time)
+                    else:
+                        for (channel, pitch, start, duration, volume) in notes:
+                            stream.addNote(channel, pitch, time + start, duration, volume)
+                    time += len(word) * 0.5
+                stream.addText(time, 'end')
+                stream.close()
+                outputs.append(output.getvalue())
+            self.assertEqual(outputs[0], outputs[1])
+
+        fragment = stream.makeFragment([(0, 60, 0.5, 1, 100)])
+        self.assertEqual((fragment.start, fragment.status, fragment.length), (480, 0x90, 1440))
+        stream = MIDIStreamWriter(BytesIO())
+        stream.addNote(0, 48, 0, 1, 100)  # ends at tick 960
+        with self.assertRaises(ValueError):
+            stream.addFragment(fragment, 0)
+
+    def testFormatZero(self):
+        from io import BytesIO
+
+        def written(midi):
+            output = BytesIO()
+            midi.writeFile(output)
+            return output.getvalue()
+
+        def addEvents(midi):
+            midi.addTrackName(0, 0, 'Narrator')
+            midi.addTempo(0, 0, 120)
+            midi.addNote(0, 0, 60, 0, 1, 100)
+            midi.addTempo(0, 1, 60)
+            midi.addNote(0, 0, 62, 1, 1, 100)
+
+        for columnar in (False, True):
+            # The tempo and note tracks are kept apart, as in a format 1 file
+            MyMIDI = MIDIFile(1, file_format=0, columnar=columnar)
+            addEvents(MyMIDI)
+            self.assertEqual(len(MyMIDI.tracks), 2)
+            self.assertEqual(len(MyMIDI.tracks[0].eventList), 2)
+
+            # But written as the one track of a format 2 file holding it all
+            Single = MIDIFile(1, file_format=2, columnar=columnar)
+            addEvents(Single)
+            data = written(MyMIDI)
+            self.assertEqual(data[:14], b'MThd' + struct.pack('>LHHH', 6, 0, 1, 960))
+            self.assertEqual(data[14:], written(Single)[14:])
+            self.assertEqual(written(MyMIDI), data)
+
+            # The merged track is rewritten when a track changes
+            MyMIDI.addNote(0, 0, 64, 2, 1, 100)
+            Single.addNote(0, 0, 64, 2, 1, 100)
+            self.assertEqual(written(MyMIDI)[14:], written(Single)[14:])
+
+    def testReader(self):
+        import os
+        import tempfile
+
+        MyMIDI = MIDIFile(1, running_status=True, zero_velocity_note_off=True)
+        MyMIDI.addTempo(0, 0, 120)
+        MyMIDI.addNote(0, 0, 60, 0, 1, 100)
+        MyMIDI.addNote(0, 0, 64, 0, 1, 90)
+        MyMIDI.addSysEx(0, 1, 0x41, b'\x01\x02')
+        MyMIDI.addProgramChange(0, 1, 200, 5)
+        (handle, path) = tempfile.mkstemp(suffix='.mid')
+        try:
+            with os.fdopen(handle, 'wb') as output_file:
+                MyMIDI.writeFile(output_file)
+            with MIDIFileReader(path) as reader:
+                self.assertEqual((reader.file_format, reader.numTracks, reader.ticks_per_quarternote),
+                                 (1, 2, 960))
+                self.assertEqual(list(reader.events(0)),
+                                 [TrackEvent(0, 0xFF, 0x51, b'\x07\xa1\x20'),
+                                  TrackEvent(0, 0xFF, 0x2F, b'')])
+                # Running status is filled in, and cancelled by the SysEx
+                self.assertEqual(MyMIDI.tracks[1].MIDIdata[16:17], b'\x90')
+                self.assertEqual(list(reader.events(1)),
+                                 [TrackEvent(0, 0x90, None, b'\x3c\x64'),
+                                  TrackEvent(0, 0x90, None, b'\x40\x5a'),
+                                  TrackEvent(960, 0xF0, None, b'\x41\x01\x02\xf7'),
+                                  TrackEvent(960, 0x90, None, b'\x3c\x00'),
+                                  TrackEvent(960, 0x90, None, b'\x40\x00'),
+                                  TrackEvent(192000, 0xC1, None, b'\x05'),
+                                  TrackEvent(192000, 0xFF, 0x2F, b'')])
+
+            with open(path, 'wb') as output_file:
+                output_file.write(b'RIFF')
+            with self.assertRaises(ValueError):
+                MIDIFileReader(path)
+
+            # A track chunk cut short by the end of the file
+            header = b'MThd' + struct.pack('>LHHH', 6, 0, 1, 960)
+            with open(path, 'wb') as output_file:
+                output_file.write(header + b'MTrk' + struct.pack('>L', 8) + b'\x00\x90\x3c')
+            with self.assertRaises(ValueError) as context:
+                MIDIFileReader(path)
+            self.assertIn('offset 14 is truncated', str(context.exception))
+
+            # Events which run past the end of their track
+            for track in (b'\x00\x90\x3c',          # a data byte short
+                          b'\x00\xff\x01\x05\x41',  # text shorter than its length
+                          b'\x00\xf0\x81',          # unfinished variable length value
+                          b'\x81'):                 # no status after the delta time
+                with open(path, 'wb') as output_file:
+                    output_file.write(b'MThd' + struct.pack('>LHHH', 6, 1, 2, 960) + b'MTrk' + struct.pack('>L', len(track)) + track +
+                                      b'MTrk' + struct.pack('>L', 4) + b'\x00\xff\x2f\x00')
+                with MIDIFileReader(path) as reader:
+                    with self.assertRaises(ValueError) as context:
+                        list(reader.events(0))
+                    self.assertIn('offset 22 runs past', str(context.exception))
+                    self.assertEqual(list(reader.events(1)), [TrackEvent(0, 0xFF, 0x2F, b'')])
+        finally:
+            os.remove(path)
+
     def testEmptyEventList(self):
         MyMIDI = MIDIFile(1)
         MyMIDI.close()
@@ -933,6 +1379,188 @@ class TestMIDIUtils(unittest.TestCase):
         MyMIDI.close()
         self.assertEqual(2, len(MyMIDI.tracks[1].eventList))
 
+    def testRemoveDuplicatesCustomEquality(self):
+        # A derived event which overrides __eq__() but not identity(), as in
+        # documentation/extending.rst
+        class CustomTempo(GenericEvent):
+            evtname = 'Tempo'
+            sec_sort_order = 3
+
+            def __init__(self, tick, tempo, insertion_order=0):
+                self.tempo = int(60000000 / tempo)
+                super(CustomTempo, self).__init__(tick, insertion_order)
+
+            def __eq__(self, other):
+                return (self.evtname == other.evtname and
+                        self.tick == other.tick and
+                        self.tempo == other.tempo)
+
+            __hash__ = GenericEvent.__hash__
+
+            def serialize(self, previous_event_tick):
+                midibytes = bytes(bytearray(writeVarLength(self.tick - previous_event_tick)))
+                return midibytes + b'\xff\x51\x03' + struct.pack('>L', self.tempo)[1:4]
+
+        MyMIDI = MIDIFile(1)
+        track = MyMIDI.tracks[0]
+        for tempo in (120, 60, 120):
+            track.addEvent(CustomTempo(0, tempo))
+        MyMIDI.close()
+        self.assertEqual([event.tempo for event in track.MIDIEventList], [500000, 1000000])
+
+        # The same for a class derived from a built in event, which inherits
+        # its identity()
+        class LoudNoteOn(NoteOn):
+            def __eq__(self, other):
+                return NoteOn.__eq__(self, other) and self.volume == other.volume
+
+            __hash__ = NoteOn.__hash__
+
+        track = MIDIFile(1).tracks[0]
+        for volume in (100, 50, 100):
+            track.addEvent(LoudNoteOn(0, 60, 0, 1, volume))
+        track.removeDuplicates()
+        self.assertEqual([event.volume for event in track.eventList], [100, 50])
+
+    def testSortEvents(self):
+        MyMIDI = MIDIFile(1)
+        MyMIDI.addNote(0, 0, 60, 2, 1, 100)
+        MyMIDI.addProgramChange(0, 0, 2, 10)
+        MyMIDI.addNote(0, 0, 61, -1, 4, 100)
+        MyMIDI.addControllerEvent(0, 0, 3, 7, 100)
+        events = MyMIDI.tracks[1].eventList
+        self.assertEqual(sortEvents(events), sorted(events, key=sort_events))
+        self.assertEqual(sortEvents(events[::-1]), sorted(events[::-1], key=sort_events))
+
+        # Events in order come back as they are
+        ordered = sorted(events, key=sort_events)
+        self.assertEqual(sortEvents(ordered), ordered)
+        self.assertEqual(sortEvents([]), [])
+
+        # A derived event may have a sec_sort_order which is above 3, or not
+        # an integer
+        class LateText(Text):
+            sec_sort_order = 5
+
+        for sec_sort_order in (5, 2.5):
+            LateText.sec_sort_order = sec_sort_order
+            MyMIDI = MIDIFile(1, file_format=2, eventtime_is_ticks=True)
+            MyMIDI.tracks[0].addEvent(LateText(0, 'A', insertion_order=0))
+            MyMIDI.addTrackName(0, 1, 'x')
+            MyMIDI.addText(0, 1, 'B')
+            MyMIDI.tracks[0].addEvent(LateText(2, 'C', insertion_order=MyMIDI.event_counter))
+            MyMIDI.close()
+            self.assertEqual(MyMIDI.tracks[0].MIDIdata,
+                             b'\x00\xff\x01\x01A\x01\xff\x03\x01x\x00\xff\x01\x01B'
+                             b'\x01\xff\x01\x01C\x00\xff\x2f\x00')
+
+            # Columnar tracks sort them among the notes the same way
+            data = []
+            for columnar in (False, True):
+                MyMIDI = MIDIFile(1, file_format=2, eventtime_is_ticks=True, columnar=columnar)
+                MyMIDI.addNote(0, 0, 60, 0, 2, 100)
+                MyMIDI.tracks[0].addEvent(LateText(0, 'A', insertion_order=MyMIDI.event_counter))
+                MyMIDI.addNote(0, 0, 62, 2, 1, 100)
+                MyMIDI.tracks[0].addEvent(LateText(2, 'C', insertion_order=MyMIDI.event_counter))
+                MyMIDI.addProgramChange(0, 0, 2, 1)
+                MyMIDI.close()
+                data.append(MyMIDI.tracks[0].MIDIdata)
+            self.assertEqual(data[0], data[1])
+
+    def testAddNotes(self):
+        # addNotes() must give the same file as adding the notes one at a time
+        pitches = [60, 62, 64, 64, 65, 67]
+        times = [0, 0.5, 1, 1, 1.5, 2.25]
+        durations = [1, 0.5, 2, 2, 0.25, 1]
+
+        def build(columnar, bulk, **kwargs):
+            MyMIDI = MIDIFile(1, columnar=columnar, **kwargs)
+            MyMIDI.addTempo(0, 0, 120)
+            if bulk:
+                MyMIDI.addNotes(0, 1, pitches, times, durations, 100)
+                MyMIDI.addNotes(0, 2, 70, 3, 1, 90)
+            else:
+                for (pitch, time, duration) in zip(pitches, times, durations):
+                    MyMIDI.addNote(0, 1, pitch, time, duration, 100)
+                MyMIDI.addNote(0, 2, 70, 3, 1, 90)
+            MyMIDI.addNote(0, 0, 50, 0, 1, 80)
+            MyMIDI.close()
+            return [track.MIDIdata for track in MyMIDI.tracks]
+
+        expected = build(False, False)
+        for columnar in (False, True):
+            self.assertEqual(build(columnar, True), expected)
+            # Without NumPy, too
+            numpy = midiutil.MidiFile.numpy
+            midiutil.MidiFile.numpy = None
+            try:
+                self.assertEqual(build(columnar, True), expected)
+            finally:
+                midiutil.MidiFile.numpy = numpy
+
+        MyMIDI = MIDIFile(1)
+        MyMIDI.addNotes(0, 0, bytearray([1, 2, 3]), [0, 1, 2], 1, 100)
+        self.assertEqual([event.insertion_order for event in MyMIDI.tracks[1].eventList],
+                         [0, 0, 1, 1, 2, 2])
+        self.assertEqual(MyMIDI.tracks[1].eventList[5].tick, MyMIDI.time_to_ticks(3))
+        self.assertRaises(ValueError, MyMIDI.addNotes, 0, 0, [1, 2], [0, 1, 2], 1, 100)
+
+    def testRemoveDuplicatesDense(self):
+        # Many events at one tick: every chord note twice, and a burst of
+        # controller events, which are never duplicates
+        MyMIDI = MIDIFile(1)
+        for i in range(2 * 16 * 128):
+            MyMIDI.addNote(0, i % 16, (i // 16) % 128, 0, 1, 100)
+        for i in range(1000):
+            MyMIDI.addControllerEvent(0, 0, 0, 7, 100)
+        track = MyMIDI.tracks[1]
+        first = track.eventList[:2 * 16 * 128]
+        track.removeDuplicates()
+        self.assertEqual(len(track.eventList), 2 * 16 * 128 + 1000)
+        # The first of each set of duplicates is kept, in order
+        self.assertTrue(all(a is b for (a, b) in zip(track.eventList, first)))
+
+        self.assertEqual(NoteOn(1, 60, 0, 1, 100).identity(), ('NoteOn', 0, 60, 1))
+        self.assertEqual(hash(NoteOn(1, 60, 0, 1, 100)), hash(NoteOn(1, 60, 0, 2, 90)))
+        self.assertIsNone(ControllerEvent(0, 0, 7, 100).identity())
+
+    def testColumnarNotes(self):
+        # A columnar file must be written exactly as the same file built
+        # from note objects.
+        def build(columnar, **kwargs):
+            MyMIDI = MIDIFile(2, columnar=columnar, **kwargs)
+            MyMIDI.addTrackName(0, 0, "track")
+            MyMIDI.addTempo(0, 0, 120)
+            MyMIDI.addProgramChange(0, 1, 0, 10)
+            MyMIDI.addNote(0, 0, 69, 0, 2, 100, annotation='first')
+            MyMIDI.addNote(0, 0, 69, 1, 2, 101)   # interleaved with the first
+            MyMIDI.addNote(0, 0, 69, 1, 2, 101)   # a duplicate
+            MyMIDI.addNote(0, 1, 60, 0.5, 200, 90)
+            MyMIDI.addControllerEvent(0, 1, 1, 7, 100)
+            MyMIDI.addNote(1, 2, 64, -1, 1, 80)
+            MyMIDI.addPitchWheelEvent(1, 2, 0.5, 1000)
+            return MyMIDI
+
+        for kwargs in ({}, {'adjust_origin': True}, {'deinterleave': False},
+                       {'removeDuplicates': False, 'deinterleave': False}, {'file_format': 2}):
+            output = []
+            for columnar in (False, True):
+                MyMIDI = build(columnar, **kwargs)
+                MyMIDI.close()
+                output.append([track.MIDIdata for track in MyMIDI.tracks])
+            self.assertEqual(output[0], output[1], kwargs)
+
+        MyMIDI = build(True)
+        self.assertEqual(len(MyMIDI.tracks[1].notes), 4)
+        self.assertEqual(MyMIDI.tracks[1].notes.annotations, {0: 'first'})
+        self.assertEqual([event.evtname for event in MyMIDI.tracks[1].eventList],
+                         ['TrackName', 'ProgramChange', 'ControllerEvent'])
+
+        # shiftTracks() shifts the columns too
+        MyMIDI.shiftTracks()
+        self.assertEqual(MyMIDI.tracks[2].notes.ticks[0], 0)
+        self.assertEqual(MyMIDI.tracks[1].notes.ticks[0], MyMIDI.time_to_ticks(1))
+
 
 def suite():
     MIDISuite = unittest.TestLoader().loadTestsFromTestCase(TestMIDIUtils)
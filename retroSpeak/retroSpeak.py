@@ -87,8 +87,10 @@ class retroSpeak():
              'FF':40, 'KK2':41, 'KK1':42, 'ZZ':43, 'NG':44, 'LL':45, 'WW':46, 'XR':47, 
              'WH':48, 'YY1':49, 'CH':50, 'ER1':51, 'ER2':52, 'OW':53, 'DH2':54, 'SS':55, 
              'NN2':56, 'HH2':57, 'OR':58, 'AR':59, 'YR':60, 'GG2':61, 'EL':62, 'BB2':63 };
+    # and the names indexed by code
+    _allophoneNames = sorted(_allophones, key=_allophones.get)
 
-    # A queue of allophone numbers to speak in the background
+    # A queue of allophones to speak in the background - names or codes
     _speaking = Queue.Queue(500)
     _isSpeaking = False
 
@@ -154,7 +156,11 @@ class retroSpeak():
                     if self._onStart != None:
                         self._onStart()
                 allophone = self._speaking.get()
-                a = self._allophones[allophone]
+                if isinstance(allophone, int):
+                    a = allophone
+                    allophone = self._allophoneNames[a]
+                else:
+                    a = self._allophones[allophone]
                 # Switch on voice chip
                 wiringpi.digitalWrite(self._ALD,True)
                 wiringpi.digitalWrite(self._RESET,True)
@@ -216,6 +222,14 @@ class retroSpeak():
             if allophone.upper() in self._allophones:
                 self._speaking.put(allophone.upper())
 
+    def speakCodes( self, codes ):
+        # Add allophone codes (0-63) to speaking queue
+        # codes can be bytes, a bytearray or an array('B') - as produced by
+        # the allophones module in the ttm project - or a list of numbers
+        for code in bytearray(codes):
+            if code < len(self._allophoneNames):
+                self._speaking.put(code)
+
     def speakAndWait(self,speech):
         # Speak allophones, but wait until they're spoken
         self.speak(speech)
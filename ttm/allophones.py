@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+#********************
+# SP0256-AL2 allophone codes
+#
+# The allophone lookup table from the SP0256-AL2 datasheet - a copy of the
+# table retroSpeak.py uses to drive the chip, which keeps its own as it runs
+# under Python 2 on the Pi. The unit tests check that the two agree. The MIDI
+# Narrator speaks the allophone whose code is the MIDI note number.
+#
+# Allophones are passed around as bytes, one code (0-63) per allophone, so
+# they can be stored, joined and sent to the chip without any string handling.
+# encode() and decode() convert to and from space separated allophone names.
+#********************
+
+from array import array
+from collections import Counter
+
+Allophones = { 'PA1':0, 'PA2':1, 'PA3':2, 'PA4':3, 'PA5':4, 'OY':5, 'AY':6, 'EH':7,
+         'KK3':8, 'PP':9, 'JH':10, 'NN1':11, 'IH':12, 'TT2':13, 'RR1':14, 'AX':15,
+         'MM':16, 'TT1':17, 'DH1':18, 'IY':19, 'EY':20, 'DD1':21, 'UW1':22, 'AO':23,
+         'AA':24, 'YY2':25, 'AE':26, 'HH1':27, 'BB1':28, 'TH':29, 'UH':30, 'UW2':31,
+         'AW':32, 'DD2':33, 'GG3':34, 'VV':35, 'GG1':36, 'SH':37, 'ZH':38, 'RR2':39,
+         'FF':40, 'KK2':41, 'KK1':42, 'ZZ':43, 'NG':44, 'LL':45, 'WW':46, 'XR':47,
+         'WH':48, 'YY1':49, 'CH':50, 'ER1':51, 'ER2':52, 'OW':53, 'DH2':54, 'SS':55,
+         'NN2':56, 'HH2':57, 'OR':58, 'AR':59, 'YR':60, 'GG2':61, 'EL':62, 'BB2':63 }
+
+# Allophone names indexed by code
+AllophoneNames = sorted(Allophones, key=Allophones.get)
+
+PA4 = Allophones['PA4']  # The pause between words
+
+# How many times encode() has skipped each name not in the table. The
+# pronunciation tables - the vocabulary and the IPA mapping - are encoded once,
+# when first used, so these are names missing from the tables, not a count of
+# allophones left out of any particular output.
+SkippedAllophoneNames = Counter()
+
+
+def encode(names):
+    # Convert allophone names - a string of them separated by spaces, or a
+    # list - into bytes of allophone codes. Names not in the table are skipped,
+    # and counted in SkippedAllophoneNames.
+    if isinstance(names, str):
+        names = names.split()
+    codes = array('B')
+    for name in names:
+        name = name.upper()
+        if name in Allophones:
+            codes.append(Allophones[name])
+        else:
+            SkippedAllophoneNames[name] += 1
+    return codes.tobytes()
+
+
+def decode(codes):
+    # Convert bytes of allophone codes into a list of allophone names
+    return [AllophoneNames[code] for code in bytearray(codes)]
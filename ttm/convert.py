@@ -1,41 +1,12 @@
 #!/usr/bin/env python
 
 import argparse
+import sys
 from datetime import datetime
-from midiutil import MIDIFile
+from functools import lru_cache
+from midiutil import MIDIStreamWriter
 from retroTTS import *
-
-# Prepare CLI args
-parser = argparse.ArgumentParser(description='Text to MIDI')
-parser.add_argument(
-    'text',
-    metavar='text',
-    nargs=argparse.REMAINDER
-)
-args = parser.parse_args()
-words = args.text
-
-# Convert text to phonemes
-phonemes = ''
-for word in words:
-    if word.lower() in vocabulary:
-        phonemes = phonemes + ' ' + vocabulary[word.lower()]
-    else:
-        phonemes = phonemes + ' ' + ' '.join(IPAtoSP0256(translateWord(word.upper())))
-    phonemes = phonemes + ' PA4'
-
-print(phonemes)
-
-
-# Create the MIDIFile Object
-MyMIDI = MIDIFile(1)
-
-# Add track name and tempo. The first argument to addTrackName and
-# addTempo is the time to write the event.
-track = 0
-time = 0
-MyMIDI.addTrackName(track, time, "MIDI Narrator Track")
-MyMIDI.addTempo(track, time, 120)
+from allophones import PA4, SkippedAllophoneNames
 
 # Default note attributes
 channel = 0
@@ -43,66 +14,113 @@ pitch = 60
 duration = 0.25
 volume = 100
 
-# Convert phonemes to MIDI notes
-note_dict = {
-    'AA': 24,
-    'AE': 26,
-    'AX': 15,
-    'AO': 23,
-    'AW': 32,
-    'AY': 6,
-    'BB1': 28,
-    'CH': 50,
-    'DD1': 21,
-    'DH1': 18,
-    'EH': 7,
-    'ER1': 51,
-    'EY': 20,
-    'FF': 40,
-    'GG2': 61,
-    'HH1': 27,
-    'IH': 12,
-    'IY': 19,
-    'JH': 10,
-    'KK1': 42,
-    'LL': 45,
-    'MM': 16,
-    'NN1': 11,
-    'NG': 44,
-    'OW': 53,
-    'OY': 5,
-    'PP': 9,
-    'RR1': 14,
-    'SS': 55,
-    'SH': 37,
-    'TT1': 17,
-    'TH': 29,
-    'UH': 30,
-    'UW2': 31,
-    'VV': 35,
-    'WW': 46,
-    'WH': 48,
-    'YY1': 49,
-    'ZZ': 43,
-    'ZH': 38,
-    'PA4': 3
-}
-
-midi_notes = []
-for phoneme in phonemes.split():
-    if phoneme in note_dict:
-        midi_notes.append(note_dict[phoneme])
-        print(note_dict[phoneme])
+# Convert allophones to MIDI notes
+# The MIDI Narrator speaks the SP0256 allophone whose code is the note number,
+# so allophone codes are used as notes just as they are - every one of the 64
+# allophones has a note.
+
+# Text flows through a pipeline of generators - words, then allophone codes -
+# so the text is never held in memory all at once.
+
+def readWords(sources):
+    # Yield the words of each file in turn, a line at a time
+    # A source of '-' reads from stdin
+    for source in sources:
+        if source == '-':
+            for line in sys.stdin:
+                for word in line.split():
+                    yield word
+        else:
+            with open(source) as text_file:
+                for line in text_file:
+                    for word in line.split():
+                        yield word
+
+
+def wordsToCodes(words):
+    # Yield the allophone codes of each word as bytes, with a pause after each word
+    pause = bytes(bytearray([PA4]))
+    for word in words:
+        yield wordToCodes(word) + pause
+
+
+def codesToFragments(MyMIDI, size=WordCacheSize):
+    # Return a function giving the MIDI fragment - the notes already
+    # serialized - for a word's allophone codes. The most recently used
+    # fragments are kept, so a common word's notes are only serialized once.
+    @lru_cache(maxsize=size)
+    def codesToFragment(codes):
+        return MyMIDI.makeFragment([(channel, note, i * duration, duration, volume)
+                                    for (i, note) in enumerate(bytearray(codes))])
+    return codesToFragment
+
+
+def main():
+    # Prepare CLI args
+    parser = argparse.ArgumentParser(description='Text to MIDI')
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=WordCacheSize,
+        help='Number of word pronunciations and MIDI fragments to cache '
+             '(default %(default)s)'
+    )
+    parser.add_argument(
+        '--cache-file',
+        help='dbm file to keep pronunciations in between runs'
+    )
+    parser.add_argument(
+        '-i', '--input',
+        action='append',
+        default=[],
+        metavar='FILE',
+        help='Read text from FILE (- for stdin). May be repeated. Text is read '
+             'from stdin if neither files nor text are given'
+    )
+    parser.add_argument(
+        'text',
+        metavar='text',
+        nargs=argparse.REMAINDER
+    )
+    args = parser.parse_args()
+    setWordCacheSize(args.cache_size)
+    setPronunciationFile(args.cache_file)
+
+    if args.text:
+        words = iter(args.text)
     else:
-        print('not found!')
+        words = readWords(args.input or ['-'])
+
+    now = datetime.now()
+
+    with open('ttm-output-{}.mid'.format(now.strftime("%Y%m%d-%H%M%S")), 'wb') as binfile:
+        # The notes are written to the file as they are made, so the MIDI is
+        # never held in memory either. Note offs are written as note ons with
+        # velocity zero, so with running status only the first note event
+        # needs a status byte.
+        MyMIDI = MIDIStreamWriter(binfile, running_status=True, zero_velocity_note_off=True)
+
+        # Add track name and tempo. The first argument to addTrackName and
+        # addTempo is the time to write the event.
+        time = 0
+        MyMIDI.addTrackName(time, "MIDI Narrator Track")
+        MyMIDI.addTempo(time, 120)
+
+        # Now add the notes of each word, one word after another. Each word
+        # is added as a whole, by copying its fragment to the file.
+        codesToFragment = codesToFragments(MyMIDI, args.cache_size)
+        for codes in wordsToCodes(words):
+            MyMIDI.addFragment(codesToFragment(codes), time)
+            time += len(codes) * duration
 
-# Now add the note.
-# And write it to disk.
+        MyMIDI.close()
 
-for i, pitch in enumerate(midi_notes):
-    MyMIDI.addNote(track, channel, pitch, time + i * 0.25, duration, volume)
+    if SkippedAllophoneNames:
+        # Report allophone names in the pronunciation tables that have no code
+        print('Allophone names with no SP0256 code, skipped in the pronunciation tables: {}'.format(
+            ', '.join('{} ({})'.format(name, count) for name, count in sorted(SkippedAllophoneNames.items()))),
+            file=sys.stderr)
 
-now = datetime.now()
 
-with open('ttm-output-{}.mid'.format(now.strftime("%Y%m%d-%H%M%S")), 'wb') as binfile:
-    MyMIDI.writeFile(binfile)
+if __name__ == '__main__':
+    main()
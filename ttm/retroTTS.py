@@ -11,6 +11,10 @@
 # Ensure retroSpeak.py, en_US_rules.py and vocabulary.py are in the path or 
 # same directory as this script
 #
+# Run it as a command - python retroTTS.py hello world - or import it and use
+# translateWord, translateText, IPAtoSP0256 and wordToSP0256. The rules and
+# vocabulary are loaded when they're first needed.
+#
 # Jason Lane 2015
 #
 # English to Phoneme text to speech
@@ -80,16 +84,30 @@
 
 
 import argparse
+import atexit
+import dbm
+import hashlib
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
 # import retroSpeak
-from en_US_rules import Rules
-from vocabulary import *
+from allophones import Allophones, PA4, decode, encode
+
+__all__ = ['translateWord', 'translateText', 'IPAtoSP0256', 'wordToSP0256',
+           'wordToCodes', 'textsToSP0256', 'textsToCodes',
+           'WordCacheSize', 'setWordCacheSize', 'wordCacheInfo',
+           'setPronunciationFile']
 
 # Parts of rules
 leftPart = 0
 matchPart = 1
 rightPart = 2
 outPart = 3
+matchLength = 4  # Only in compiled rules
+outCodes = 5  # Only in compiled rules
 
 
 def isVowel(c):
@@ -100,117 +118,256 @@ def isConsonant(c):
     return c.isupper() and not isVowel(c)
 
 
+def compileRules(rules):
+    # Build an index over the rules so that only rules whose match part fits
+    # the word are tried. Each letter maps to a prefix trie of its match parts.
+    # A trie node is a (children, candidates) pair. The candidates of a node are
+    # all rules whose match part is a prefix of the path to that node, kept in
+    # their original order so the first matching rule still wins.
+    # The rules are stored compiled - see compileRule()
+    index = {}
+    for letter, letter_rules in rules.items():
+        root = ({}, [])
+        for order, rule in enumerate(letter_rules):
+            node = root
+            for c in rule[matchPart]:
+                node = node[0].setdefault(c, ({}, []))
+            node[1].append(order)
+        index[letter] = finishTrie(root, [], [compileRule(rule) for rule in letter_rules])
+    return index
+
+
+def compileRule(rule):
+    # The left and right parts are compiled into anchored regular expressions
+    # (see compilePattern). The out part is split into its phonemes, and the
+    # length of the match part is kept to find the remainder of the word.
+    # The phonemes are also stored as SP0256 allophone codes.
+    phonemes = tuple(rule[outPart].split())
+    return (compilePattern(rule[leftPart][::-1]), rule[matchPart],
+            compilePattern(rule[rightPart], right=True),
+            phonemes, len(rule[matchPart]),
+            b''.join(IPACodes[p] for p in phonemes if p in IPACodes))
+
+
+# Regular expressions for the special context symbols
+# The NRL rules never backtrack - '#' and ':' take as many letters as they can -
+# so repeats are wrapped as (?=(...))\N, which behaves as an atomic group
+Consonant = '[B-DF-HJ-NP-TV-Z]'
+ContextSymbols = {'#': '[AEIOU]+', ':': Consonant + '*', '^': Consonant,
+                  '.': '[BDVGJLMNRWZ]', '+': '[EIY]'}
+AtomicSymbols = ('#', ':', '%')
+# ER, E, ES, ED, ING, ERY (a suffix) - including the letter after it,
+# as the interpreter steps past it too
+SuffixPattern = 'ING.|ERY.|E[RSD].|E.'
+
+
+def compilePattern(pattern, right=False):
+    # Compile a context pattern into a regular expression matched at the
+    # first letter of context. Left hand patterns are passed in reversed, and
+    # are matched against the reversed word, so both read away from the centre.
+    # An empty pattern matches any context and compiles to None.
+    if pattern == '':
+        return None
+    regex = ''
+    group = 0
+    for p in pattern:
+        if p.isalpha() or p == "'" or p == " ":
+            part = re.escape(p)
+        elif p in ContextSymbols:
+            part = ContextSymbols[p]
+        elif right and p == '%':
+            part = SuffixPattern
+        else:
+            print("Bad char in {} pattern: '{}'".format('right' if right else 'left', p))
+            part = '(?!)'  # Never matches
+        if p in AtomicSymbols:
+            group = group + 1
+            part = '(?=({}))\\{}'.format(part, group)
+        regex = regex + part
+    return re.compile(regex)
+
+
+def finishTrie(node, inherited, letter_rules):
+    # Merge the rules ending at this node with those inherited from shorter
+    # match parts, and swap rule numbers for the rules themselves
+    orders = sorted(inherited + node[1])
+    children = {}
+    for c, child in node[0].items():
+        children[c] = finishTrie(child, orders, letter_rules)
+    return children, [letter_rules[o] for o in orders]
+
+
+# The rules and vocabulary are only loaded when they are first needed
+RuleIndex = None
+Vocabulary = None
+VocabularyCodes = None
+
+
+def getRuleIndex():
+    # Return the rules compiled by compileRules(), compiling them on first use
+    global RuleIndex
+    if RuleIndex is None:
+        from en_US_rules import Rules
+        RuleIndex = compileRules(Rules)
+    return RuleIndex
+
+
+def getVocabulary():
+    # Return the vocabulary of known words, loading it on first use
+    global Vocabulary
+    if Vocabulary is None:
+        from vocabulary import vocabulary
+        Vocabulary = vocabulary
+    return Vocabulary
+
+
+def getVocabularyCodes():
+    # Return the vocabulary with each word's allophones as codes
+    global VocabularyCodes
+    if VocabularyCodes is None:
+        VocabularyCodes = dict((word, encode(allophones))
+                               for word, allophones in getVocabulary().items())
+    return VocabularyCodes
+
+
 def translateWord(t_word):
     # Return a list of IPA phonemes that make up the word
-    t_phonemes = ''
+    t_phonemes = []
+    for rule in matchWord(t_word):
+        t_phonemes.extend(rule[outPart])
+    return t_phonemes
+
+
+def translateWordCodes(t_word):
+    # Return the SP0256 allophone codes for the word as bytes
+    return b''.join([rule[outCodes] for rule in matchWord(t_word)])
+
+
+def matchWord(t_word):
+    # Return the list of compiled rules that translate the word
+    rules = []
     t_word = ' ' + t_word + ' '  # Add padding spaces either side of word
+    l_word = t_word[::-1]  # Reversed word for matching left hand patterns
     index = 1  # start on first letter of word - after added space
+    rule_index = getRuleIndex()
     while index < len(t_word)-1:
         # print "Index: {} Letter:{}".format(index,word[index])
         if t_word[index].isupper():
-            letter_rules = Rules[t_word[index]]
+            letter_rules = rule_index[t_word[index]]
         else:
-            letter_rules = Rules['punctuation']
-        index, phoneme = findRule(t_word, index, letter_rules)
-        if phoneme != '':
-            t_phonemes = t_phonemes + ' ' + phoneme
-    return t_phonemes.split()
+            letter_rules = rule_index['punctuation']
+        index, rule = findRule(t_word, l_word, index, letter_rules)
+        rules.append(rule)
+    return rules
 
 
-def findRule(r_word, index, rules):
+def findRule(r_word, l_word, index, rules):
     # Find the matching rule for the character in the word
+    # l_word is r_word reversed, for matching left patterns
     # index is the position of the character to check
-    # rules is a list of the rules corresponding to the character    
-    # Find a matching centre pattern, then check the left and right patterns
-    # Left hand pattern and text is reversed, as the test moves away from centre character
+    # rules is the compiled trie of the rules corresponding to the character
+    # Walk the trie as far as the word allows - the node reached lists, in order,
+    # every rule whose centre pattern matches - then check the left and right patterns
+    # The left pattern is matched in the reversed word, starting at the letter
+    # before the centre pattern, and the right pattern after the centre pattern.
     # If all 3 tests match, return the index of the remainder of the word, and the
-    # phoneme of the matched rule.
-    for rule in rules:
-        if rule[1] == r_word[index:index+len(rule[matchPart])]:
-            # Found a matching centre pattern
-            left_rule = rule[leftPart]
-            right_rule = rule[rightPart]
-            remainder = index+len(rule[matchPart])
-            left_word = r_word[:index]  # All letters before centre pattern
-            right_word = r_word[remainder:]  # All letters after centre pattern
-            # Check for left match and right match
-            if lrMatch(left_rule, left_word) and lrMatch(right_rule, right_word, right=True):
-                return remainder, rule[outPart]
+    # matched rule.
+    children, candidates = rules
+    pos = index
+    while pos < len(r_word) and r_word[pos] in children:
+        children, candidates = children[r_word[pos]]
+        pos = pos+1
+    left = len(r_word)-index
+    for rule in candidates:
+        # Found a matching centre pattern
+        left_rule = rule[leftPart]
+        right_rule = rule[rightPart]
+        remainder = index+rule[matchLength]
+        # Check for left match and right match
+        if (left_rule is None or left_rule.match(l_word, left)) and \
+                (right_rule is None or right_rule.match(r_word, remainder)):
+            return remainder, rule
     # Rule not Found        
-    print("Error: Can't find rule for '{}' in '{}'".format(word[index],word))
-    return index+1, ''
+    print("Error: Can't find rule for '{}' in '{}'".format(r_word[index],r_word))
+    return index+1, NoRule
 
 
-def lrMatch(pattern, context, right=False):
-    # Pattern matching
-    # pattern is the rule to check for, context is the text to left or right of the letter
-    # the right flag signifies checking to the right or left of the current letter
-    # If checking to the left, the pattern and context are reversed
-    # print "{} Pattern:'{}' Context:'{}'".format('Right:' if right else 'Left:',pattern,context)
-    if pattern == '':
-        # Empty pattern matches any context
-        return True
-    if not right:
-        # left hand rule - reverse pattern and context
-        pattern = pattern[::-1]
-        context = context[::-1]
-    text_pos = 0
+# Stands in for a rule when no rule matches - it has no phonemes
+NoRule = (None, '', None, (), 0, b'')
+
+
+def lrMatch(pattern, word, pos, step):
+    # Pattern matching, interpreting the pattern directly
+    # The rules are matched with compiled patterns (see compilePattern), this
+    # is kept as the reference they are checked against
+    # pattern is the rule to check for, word is the padded word being translated
+    # pos is the position of the first letter of context to check, and step is
+    # 1 to check to the right of the matched letters or -1 to check to the left
+    # Left hand patterns are stored reversed, so both read away from the centre
+    # Running off either end of the word never matches
+    # print "{} Pattern:'{}' Pos:{}".format('Right:' if step > 0 else 'Left:',pattern,pos)
+    end = len(word)
     for p in pattern:
+        if not 0 <= pos < end:
+            return False
         # First check for simple text or space
         if p.isalpha() or p == "'" or p == " ":
-            if p == context[text_pos]:
-                text_pos = text_pos+1
+            if p == word[pos]:
+                pos = pos+step
                 continue
             else:
                 return False
         if p == '#':
             # One or more vowels
-            if not isVowel(context[text_pos]):
+            if not isVowel(word[pos]):
                 return False
-            text_pos = text_pos+1
-            while isVowel(context[text_pos]):
-                text_pos = text_pos+1
+            pos = pos+step
+            while 0 <= pos < end and isVowel(word[pos]):
+                pos = pos+step
         elif p == ':':
             # zero or more consonant
-            while isConsonant(context[text_pos]):
-                text_pos = text_pos+1
+            while 0 <= pos < end and isConsonant(word[pos]):
+                pos = pos+step
         elif p == '^':
             # One consonant
-            if not isConsonant(context[text_pos]):
+            if not isConsonant(word[pos]):
                 return False
-            text_pos = text_pos+1
+            pos = pos+step
         elif p == '.':
             #  B, D, V, G, J, L, M, N, R, W, Z
-            if context[text_pos] not in "BDVGJLMNRWZ":
+            if word[pos] not in "BDVGJLMNRWZ":
                 return False
-            text_pos = text_pos+1
+            pos = pos+step
         elif p == '+':
             # E, I or Y (front vowel)
-            if context[text_pos] not in "EIY":
+            if word[pos] not in "EIY":
                 return False
-            text_pos = text_pos+1
-        elif right and p == '%':
+            pos = pos+step
+        elif step > 0 and p == '%':
             # ER, E, ES, ED, ING, ELY (a suffix)
             # Only used in right hand rules
-            if context[text_pos:text_pos + 3] == 'ING' or context[text_pos:text_pos + 3] == 'ERY':
-                text_pos = text_pos + 4
-            elif context[text_pos:text_pos + 2] == 'ER' or \
-                    context[text_pos:text_pos + 2] == 'ES' or \
-                    context[text_pos:text_pos + 2] == 'ED':
-                text_pos = text_pos + 3
-            elif context[text_pos] == 'E':
-                text_pos = text_pos + 2
+            if word.startswith('ING', pos) or word.startswith('ERY', pos):
+                pos = pos + 4
+            elif word.startswith('ER', pos) or \
+                    word.startswith('ES', pos) or \
+                    word.startswith('ED', pos):
+                pos = pos + 3
+            elif word[pos] == 'E':
+                pos = pos + 2
             else:
                 return False
         else:
-            print("Bad char in {} pattern: '{}'".format('right' if right else 'left', p))
+            print("Bad char in {} pattern: '{}'".format('right' if step > 0 else 'left', p))
             return False
     return True
 
 
 def translateText(text):
     # Translate the text and return a list with the phonetic version of the words
+    # text is either a string, or a list of words
     # Each word in the list is a list of phonemes.
+    if isinstance(text, str):
+        text = text.split()
     t_phonemes = []
     for t_word in text:
         t_phonemes.append(translateWord(t_word.upper()))
@@ -228,6 +385,10 @@ NRLIPAtoSPO256 = {'AA': 'AA', 'AE': 'AE', 'AH': 'AX AX', 'AO': 'AO', 'AW': 'AW',
                   'w': 'WW', 'WH': 'WH', 'y': 'YY1', 'z': 'ZZ', 'ZH': 'ZH', 'PAUSE': 'PA4'}
 
 
+# The same mapping to SP0256 allophone codes
+IPACodes = dict((ipa, encode(sp0256)) for ipa, sp0256 in NRLIPAtoSPO256.items())
+
+
 def IPAtoSP0256(ipa_phonemes):
     # convert a list of IPA phonemes into SP0256 phonemes
     sp0256 = []
@@ -237,26 +398,235 @@ def IPAtoSP0256(ipa_phonemes):
     return sp0256
 
 
-parser = argparse.ArgumentParser(description='Simple Text to Speech')
-parser.add_argument('text', metavar='text', nargs=argparse.REMAINDER, help='Text to speak')
-args = parser.parse_args()
+# Words are translated through a least recently used cache, as text tends to
+# repeat the same words over and over
+WordCacheSize = 4096
+
+
+def lookupWord(n_word):
+    # Return the SP0256 allophone codes for a word, which should already
+    # be normalised to upper case. Words in the vocabulary are used as they are,
+    # anything else comes from the pronunciation file if one is set, or else
+    # is translated with the rules (and then added to the pronunciation file).
+    codes = knownWord(n_word)
+    if codes is None:
+        codes = translateWordCodes(n_word)
+        rememberWord(n_word, codes)
+    return codes
+
+
+def knownWord(n_word):
+    # Return the allophone codes for a normalised word from the vocabulary or
+    # the pronunciation file, or None if it has to be translated
+    vocabulary = getVocabularyCodes()
+    if n_word.lower() in vocabulary:
+        return vocabulary[n_word.lower()]
+    store = openPronunciations()
+    if store is not None:
+        key = n_word.encode('utf-8')
+        if key in store:
+            return store[key]
+    return None
+
+
+def rememberWord(n_word, codes):
+    # Add a translated word to the pronunciation file, if one is set
+    store = openPronunciations()
+    if store is not None:
+        store[n_word.encode('utf-8')] = codes
+
+
+cachedWord = lru_cache(maxsize=WordCacheSize)(lookupWord)
+
+
+def wordToCodes(word):
+    # Return the SP0256 allophone codes for a word as bytes, using the cache
+    return cachedWord(word.upper())
+
+
+def wordToSP0256(word):
+    # Return a tuple of the SP0256 allophones for a word, using the cache
+    return tuple(decode(wordToCodes(word)))
+
+
+# Pronunciations can also be kept on disk, in a dbm file shared between runs.
+# Words are stored as allophone codes.
+# The file is stamped with a hash of the rules, vocabulary and phoneme mapping,
+# and is emptied when opened if they have changed since it was written.
+PronunciationFile = None
+pronunciations = None  # The open dbm file, opened on first use
+RuleSetKey = b'#ruleset'  # Never an upper case word
+
+
+def ruleSetHash():
+    # Hash everything that decides how a word is pronounced
+    from en_US_rules import Rules
+    vocabulary = getVocabulary()
+    digest = hashlib.sha1()
+    digest.update(repr(sorted(Rules.items())).encode('utf-8'))
+    digest.update(repr(sorted(vocabulary.items())).encode('utf-8'))
+    digest.update(repr(sorted(NRLIPAtoSPO256.items())).encode('utf-8'))
+    digest.update(repr(sorted(Allophones.items())).encode('utf-8'))
+    return digest.hexdigest().encode('ascii')
+
+
+def setPronunciationFile(path):
+    # Use the dbm file at path (created if need be) to store pronunciations,
+    # or None to stop using one. The file isn't opened until it's needed.
+    global PronunciationFile
+    closePronunciations()
+    PronunciationFile = path
+    cachedWord.cache_clear()
+
+
+def openPronunciations():
+    # Return the open pronunciation file, opening it if this is its first use
+    global pronunciations
+    if pronunciations is None and PronunciationFile is not None:
+        stamp = ruleSetHash()
+        pronunciations = dbm.open(PronunciationFile, 'c')
+        if pronunciations.get(RuleSetKey) != stamp:
+            # Written with different rules - start again
+            pronunciations.close()
+            pronunciations = dbm.open(PronunciationFile, 'n')
+            pronunciations[RuleSetKey] = stamp
+    return pronunciations
+
+
+def closePronunciations():
+    # Close the pronunciation file, if it's open
+    global pronunciations
+    if pronunciations is not None:
+        pronunciations.close()
+        pronunciations = None
+
+
+# Some dbm implementations only write their index on close
+atexit.register(closePronunciations)
+
+
+def setWordCacheSize(size):
+    # Replace the word cache with an empty one holding up to size words
+    # A size of None lets the cache grow without limit, 0 disables it
+    global cachedWord
+    cachedWord = lru_cache(maxsize=size)(lookupWord)
+
+
+def wordCacheInfo():
+    # Return the cache hits, misses, maxsize and currsize as a named tuple
+    return cachedWord.cache_info()
+
+
+def translateWords(n_words):
+    # Translate a list of normalised words into allophone codes with the rules
+    # This is what the worker processes of textsToCodes run
+    return [translateWordCodes(n_word) for n_word in n_words]
+
+
+def textsToSP0256(texts, workers=None, chunksize=256):
+    # As textsToCodes, but with a tuple of allophone names for each word
+    return ([tuple(decode(codes)) for codes in words]
+            for words in textsToCodes(texts, workers, chunksize))
+
+
+def textsToCodes(texts, workers=None, chunksize=256):
+    # Translate many texts, sharing the work between processes
+    # Each text is a string or a list of words. Words that aren't already known
+    # are translated once each, in chunks of chunksize words spread over
+    # workers processes (by default one per CPU). For each text, in order, a
+    # list with the allophone codes of each word is yielded as soon as all its
+    # words are done. The texts are read as they are needed, so only a few
+    # chunks of work, and the texts waiting on them, are held at once.
+    if chunksize <= 0:
+        raise ValueError('chunksize must be at least 1, not {}'.format(chunksize))
+    return translateTexts(texts, workers or os.cpu_count() or 1, chunksize)
+
+
+def translateTexts(texts, workers, chunksize):
+    # The generator behind textsToCodes. At most two chunks per worker are
+    # submitted at a time, and at most that many chunks' worth of texts wait
+    # for them; beyond that, reading the texts waits for the oldest chunk.
+    max_chunks = 2 * workers
+    max_waiting = max_chunks * chunksize
+    known = {}
+    chunk_of = {}  # Chunk number of each word being translated
+    chunk = []  # The words of the next chunk to submit
+    submitted = deque()  # The words and future of each chunk submitted
+    waiting = deque()  # The words of each text not yet yielded, and the last chunk it needs
+    finished = 0  # The number of chunks whose words are known
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+
+        def submit():
+            submitted.append((list(chunk), pool.submit(translateWords, list(chunk))))
+            del chunk[:]
+
+        def collect():
+            # Wait for the oldest chunk submitted, and then yield the texts
+            # that were waiting for it
+            nonlocal finished
+            n_words, future = submitted.popleft()
+            for n_word, codes in zip(n_words, future.result()):
+                known[n_word] = codes
+                del chunk_of[n_word]
+                rememberWord(n_word, codes)
+            finished = finished + 1
+            yield from ready()
+
+        def ready():
+            while waiting and waiting[0][1] < finished:
+                yield [known[n_word] for n_word in waiting.popleft()[0]]
+
+        for text in texts:
+            if isinstance(text, str):
+                text = text.split()
+            n_words = [word.upper() for word in text]
+            last_chunk = -1
+            for n_word in n_words:
+                if n_word not in known and n_word not in chunk_of:
+                    codes = knownWord(n_word)
+                    if codes is None:
+                        chunk_of[n_word] = finished + len(submitted)
+                        chunk.append(n_word)
+                        if len(chunk) == chunksize:
+                            submit()
+                    else:
+                        known[n_word] = codes
+                if n_word in chunk_of:
+                    last_chunk = max(last_chunk, chunk_of[n_word])
+            waiting.append((n_words, last_chunk))
+
+            if chunk and len(waiting) >= max_waiting:
+                submit()
+            while submitted and (len(submitted) > max_chunks or len(waiting) >= max_waiting):
+                yield from collect()
+            yield from ready()
+
+        if chunk:
+            submit()
+        while submitted:
+            yield from collect()
+
 
-phonemes = ''
-for word in args.text:
-    if word.lower() in vocabulary:
-        phonemes = phonemes + ' ' + vocabulary[word.lower()]
-    else:
-        phonemes = phonemes + ' ' + ' '.join(IPAtoSP0256(translateWord(word.upper())))
-    phonemes = phonemes + ' PA4'
+def main():
+    parser = argparse.ArgumentParser(description='Simple Text to Speech')
+    parser.add_argument('text', metavar='text', nargs=argparse.REMAINDER, help='Text to speak')
+    args = parser.parse_args()
 
-# if args.verbose or args.silent:
+    codes = bytearray()
+    for word in args.text:
+        codes.extend(wordToCodes(word))
+        codes.append(PA4)
 
-# print phonemes
+    # if args.verbose or args.silent:
 
-# if not(args.silent):
-#     # Initialise retroSpeak board
-#     speech = retroSpeak.retroSpeak(clock=args.mhz,device=args.board)
-#     speech.speakAndWait(phonemes)
+    print(' '.join(decode(codes)))
 
+    # if not(args.silent):
+    #     # Initialise retroSpeak board
+    #     speech = retroSpeak.retroSpeak(clock=args.mhz,device=args.board)
+    #     speech.speakAndWait(phonemes)
 
 
+if __name__ == '__main__':
+    main()
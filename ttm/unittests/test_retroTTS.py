@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -----------------------------------------------------------------------------
+# Name:        test_retroTTS.py
+# Purpose:     Unit testing harness for the text to phoneme conversion
+#
+# Run from the ttm directory:
+#
+#     python -m pytest unittests
+# -----------------------------------------------------------------------------
+
+from __future__ import division, print_function
+import ast
+import itertools
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+
+import unittest
+
+from en_US_rules import Rules
+from vocabulary import vocabulary
+import retroTTS
+from allophones import Allophones, SkippedAllophoneNames, decode, encode
+from retroTTS import compilePattern, lrMatch, translateWord, wordToSP0256
+
+
+def wordList(count=2000, seed=1976):
+    '''
+    The vocabulary, plus the match parts of the rules, plus a repeatable
+    set of random letter strings weighted towards vowels.
+    '''
+    words = [word.upper() for word in vocabulary]
+    for letter_rules in Rules.values():
+        words.extend(rule[1] for rule in letter_rules)
+    rnd = random.Random(seed)
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZAEIOUEY'-"
+    for i in range(count):
+        words.append(''.join(rnd.choice(letters) for j in range(rnd.randint(1, 12))))
+    return words
+
+
+class TestRetroTTS(unittest.TestCase):
+
+    def testCompiledPatterns(self):
+        # Every compiled context must agree with the interpreter at every
+        # position of every word
+        patterns = set()
+        for letter_rules in Rules.values():
+            for rule in letter_rules:
+                patterns.add((rule[0], False))
+                patterns.add((rule[2], True))
+        compiled = [(pattern, right, compilePattern(pattern[::-1] if not right else pattern, right=right))
+                    for (pattern, right) in patterns if pattern != '']
+        for word in wordList():
+            padded = ' ' + word + ' '
+            reversed_word = padded[::-1]
+            for pos in range(len(padded)):
+                for (pattern, right, regex) in compiled:
+                    if right:
+                        expected = lrMatch(pattern, padded, pos, 1)
+                        actual = regex.match(padded, pos) is not None
+                    else:
+                        expected = lrMatch(pattern[::-1], padded, pos, -1)
+                        actual = regex.match(reversed_word, len(padded) - 1 - pos) is not None
+                    self.assertEqual(expected, actual, (pattern, right, padded, pos))
+
+    def testTranslateWord(self):
+        self.assertEqual(translateWord('HELLO'), ['h', 'EH', 'l', 'OW'])
+        self.assertEqual(translateWord('WORLD'), ['w', 'ER', 'l', 'd'])
+        self.assertEqual(translateWord('RUNNING'), ['r', 'AH', 'n', 'n', 'IH', 'NG'])
+
+    def testAllophoneCodes(self):
+        skipped = SkippedAllophoneNames['XX']
+        self.assertEqual(encode('HH1 EH ll LL AX OW PA4 XX'), b'\x1b\x07\x2d\x2d\x0f\x35\x03')
+        self.assertEqual(SkippedAllophoneNames['XX'], skipped + 1)
+        self.assertEqual(decode(b'\x1b\x07\x2d\x3f'), ['HH1', 'EH', 'LL', 'BB2'])
+        # The codes compiled into the rules agree with mapping the phonemes
+        for word in wordList(500):
+            expected = encode(' '.join(retroTTS.IPAtoSP0256(translateWord(word))))
+            self.assertEqual(retroTTS.translateWordCodes(word), expected, word)
+
+    def testAllophoneTable(self):
+        # The table is a copy of the one retroSpeak.py drives the chip with.
+        # That is Python 2 code for the Raspberry Pi, which can't import it
+        # (or be parsed here), so read its table literal to check the two agree
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', '..', 'retroSpeak', 'retroSpeak.py')
+        if not os.path.exists(path):
+            self.skipTest('retroSpeak.py is not alongside ttm')
+        with open(path) as source:
+            tables = re.findall(r'^\s*_allophones\s*=\s*(\{.*?\})', source.read(), re.M | re.S)
+        self.assertEqual([ast.literal_eval(table) for table in tables], [Allophones])
+
+    def testWordCache(self):
+        retroTTS.setWordCacheSize(2)
+        self.assertEqual(wordToSP0256('helps'), ('HH1', 'EH', 'LL', 'PP', 'SS'))
+        self.assertEqual(wordToSP0256('Helps'), ('HH1', 'EH', 'LL', 'PP', 'SS'))
+        self.assertEqual(wordToSP0256('and'), ('AE', 'AE', 'NN1', 'PA2', 'DD1'))  # from the vocabulary
+        wordToSP0256('fish')
+        info = retroTTS.wordCacheInfo()
+        self.assertEqual((info.hits, info.misses, info.maxsize, info.currsize), (1, 3, 2, 2))
+        retroTTS.setWordCacheSize(retroTTS.WordCacheSize)
+
+    def testTextsToSP0256(self):
+        texts = ['the quick brown fox', 'jumps over the lazy dog', '',
+                 ['the', 'Lazy', 'dog'], 'and the zebra crossing']
+        expected = [[wordToSP0256(word) for word in (text.split() if isinstance(text, str) else text)]
+                    for text in texts]
+        self.assertEqual(list(retroTTS.textsToSP0256(texts, workers=2, chunksize=2)), expected)
+        self.assertEqual(list(retroTTS.textsToSP0256(['hello world'])), [[wordToSP0256('hello'), wordToSP0256('world')]])
+
+        # The texts are read as they are needed, so they can go on for ever
+        def letters(number):
+            return ''.join(chr(ord('B') + int(digit)) for digit in str(number))
+
+        endless = ('the {}'.format(letters(number)) for number in itertools.count())
+        results = retroTTS.textsToSP0256(endless, workers=1, chunksize=3)
+        for number in range(10):
+            self.assertEqual(next(results), [wordToSP0256('the'), wordToSP0256(letters(number))])
+        results.close()
+
+        with self.assertRaises(ValueError):
+            retroTTS.textsToSP0256(texts, chunksize=0)
+
+    def testPronunciationFile(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'pronunciations')
+        try:
+            retroTTS.setPronunciationFile(path)
+            self.assertEqual(wordToSP0256('helps'), ('HH1', 'EH', 'LL', 'PP', 'SS'))
+            retroTTS.closePronunciations()
+            # A stored pronunciation is used in preference to the rules
+            store = retroTTS.openPronunciations()
+            self.assertEqual(store[b'HELPS'], encode('HH1 EH LL PP SS'))
+            store[b'HELPS'] = encode('PA1')
+            retroTTS.setPronunciationFile(path)
+            self.assertEqual(wordToSP0256('helps'), ('PA1',))
+            # The file is emptied if the rules have changed
+            store = retroTTS.openPronunciations()
+            store[retroTTS.RuleSetKey] = b'stale'
+            retroTTS.setPronunciationFile(path)
+            self.assertEqual(wordToSP0256('helps'), ('HH1', 'EH', 'LL', 'PP', 'SS'))
+        finally:
+            retroTTS.setPronunciationFile(None)
+            shutil.rmtree(directory)
+
+    def testRuleIndexOrder(self):
+        # The trie must offer every rule whose match part fits, in rule order
+        for letter, letter_rules in Rules.items():
+            children, candidates = retroTTS.getRuleIndex()[letter]
+            for rule in letter_rules:
+                node = (children, candidates)
+                for c in rule[1]:
+                    node = node[0][c]
+                matches = [r for r in letter_rules if rule[1].startswith(r[1])]
+                self.assertEqual([r[1] for r in node[1]], [r[1] for r in matches])
+
+
+def suite():
+    TTSSuite = unittest.TestLoader().loadTestsFromTestCase(TestRetroTTS)
+
+    return TTSSuite
+
+
+if __name__ == '__main__':
+    print("Beginning retroTTS Test Suite")
+    TTSSuite = suite()
+    runner = unittest.TextTestRunner(verbosity=2, stream=sys.stdout)
+    return_value = not runner.run(TTSSuite).wasSuccessful()
+    sys.exit(return_value)